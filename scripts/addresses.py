@@ -0,0 +1,49 @@
+from collections import Counter
+
+from eth_utils import to_checksum_address
+
+
+def toAddressBytes(address):
+    '''
+        takes an address as hex string of any casing or as bytes and returns its 20 bytes
+    '''
+    if isinstance(address, str):
+        value = bytes.fromhex(address[2:] if address[:2] in ('0x', '0X') else address)
+    else:
+        value = bytes(address)
+    if len(value) != 20:
+        raise ValueError(f"{address} is not a 20 byte address")
+    return value
+
+
+def toChecksum(address_bytes):
+    return to_checksum_address('0x' + address_bytes.hex())
+
+
+def addressSet(addresses):
+    return {toAddressBytes(address) for address in addresses}
+
+
+def canonicalize(snapshot):
+    '''
+        re-keys a snapshot by 20 byte address, summing entries that only differed in casing
+    '''
+    canonical = Counter()
+    for address, amount in snapshot.items():
+        canonical[toAddressBytes(address)] += amount
+    return canonical
+
+
+def excludeAddresses(snapshot, excluded):
+    '''
+        splits snapshot against a set of 20 byte addresses in one pass,
+        returning (kept snapshot, removed keys)
+    '''
+    kept = {}
+    removed = []
+    for address, amount in snapshot.items():
+        if toAddressBytes(address) in excluded:
+            removed.append(address)
+        else:
+            kept[address] = amount
+    return kept, removed
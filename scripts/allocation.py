@@ -0,0 +1,43 @@
+from collections import Counter
+from heapq import nlargest
+from itertools import repeat
+
+from brownie import web3, Wei
+
+
+def allocate(balances, budget):
+    '''
+        splits budget pro-rata to balances in exact integers. the units lost to
+        flooring go one each to the largest remainders, so shares sum to budget
+    '''
+    accounts = list(balances)
+    weights = list(balances.values())
+    total = sum(weights)
+    if total == 0:
+        return {}
+    quotients = list(map(divmod, map(budget.__mul__, weights), repeat(total)))
+    shares = [share for share, _ in quotients]
+    leftover = budget - sum(shares)
+    for i in nlargest(leftover, range(len(quotients)), key=lambda i: quotients[i][1]):
+        shares[i] += 1
+    return dict(zip(accounts, shares))
+
+
+def allocateSources(sources, final=None):
+    '''
+        takes (name, balances, budget) per source and adds every source's
+        allocation to final, keyed by checksum address. returns (final, grand_total)
+    '''
+    final = Counter() if final is None else final
+    checksummed = {}
+    grand_total = 0
+    for name, balances, budget in sources:
+        shares = allocate(balances, budget)
+        for account, share in shares.items():
+            if account not in checksummed:
+                checksummed[account] = web3.toChecksumAddress(account)
+            final[checksummed[account]] += share
+        check = sum(shares.values())
+        grand_total += check
+        print(f"{name}:", Wei(check).to("ether"))
+    return final, grand_total
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from brownie import web3
+from eth_hash.auto import keccak as keccak256
+
+from .addresses import toAddressBytes, toChecksum
+from .cache import CodeCache, CODE_CACHE_PATH
+from .rpc import BatchRpc
+
+
+# what an address without code hashes to
+EMPTY_CODE_HASH = keccak256(b'')
+
+
+class CodeFetcher:
+    '''
+        resolves the keccak of addresses' bytecode at a block with batched
+        eth_getCode calls. hashes are cached per block, so each address costs
+        one call per block ever
+    '''
+    def __init__(self, batch_size=100, max_workers=4, rpc=None, cache_path=CODE_CACHE_PATH):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.rpc = rpc if rpc is not None else BatchRpc()
+        self.cache_path = cache_path
+        self._cache = None
+        # (address, block) -> code hash for everything seen this run
+        self.known = {}
+
+    @property
+    def cache(self):
+        # opened on first use, so importing the scripts never creates the database
+        if self._cache is None and self.cache_path:
+            self._cache = CodeCache.open(self.cache_path)
+        return self._cache
+
+    def fetch_batch(self, addresses, block):
+        if self.rpc.endpoint is None:
+            codes = [bytes(web3.eth.getCode(toChecksum(address), block)) for address in addresses]
+        else:
+            params = [['0x' + address.hex(), hex(block)] for address in addresses]
+            codes = [bytes.fromhex(code[2:]) for code in self.rpc.call('eth_getCode', params)]
+        return {address: keccak256(code) for address, code in zip(addresses, codes)}
+
+    def get_many(self, addresses, block):
+        '''
+            takes addresses in any form and returns {20 byte address: code hash} at block.
+            block is always explicit, a moving head would never hit the cache across runs
+        '''
+        addresses = list(dict.fromkeys(toAddressBytes(address) for address in addresses))
+        code_hashes = {
+            address: self.known[address, block] for address in addresses if (address, block) in self.known
+        }
+        unknown = [address for address in addresses if address not in code_hashes]
+        if self.cache is not None and unknown:
+            code_hashes.update(self.cache.get_many(unknown, block))
+        missing = [address for address in addresses if address not in code_hashes]
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for result in pool.map(self.fetch_batch, batches, [block] * len(batches)):
+                fetched.update(result)
+        if self.cache is not None and fetched:
+            self.cache.add_many(block, fetched)
+        code_hashes.update(fetched)
+        self.known.update(((address, block), code_hash) for address, code_hash in code_hashes.items())
+        return code_hashes
+
+    def get(self, address, block):
+        address = toAddressBytes(address)
+        if (address, block) in self.known:
+            return self.known[address, block]
+        return self.get_many([address], block)[address]
+
+    def is_contract(self, address, block):
+        return self.get(address, block) != EMPTY_CODE_HASH
+
+
+CODE = CodeFetcher()
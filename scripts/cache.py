@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from functools import wraps
+from pathlib import Path
+from types import CodeType
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+
+LOG_CACHE_PATH = './cache/logs.db'
+
+# raw log fields that web3 hands back as HexBytes
+LOG_BYTES_FIELDS = ('transactionHash', 'blockHash')
+
+
+def encodeLog(log):
+    '''
+        turns a raw eth_getLogs entry into json text
+    '''
+    encoded = {}
+    for key, value in log.items():
+        if key == 'topics':
+            value = ['0x' + bytes(topic).hex() for topic in value]
+        elif isinstance(value, bytes):
+            value = '0x' + bytes(value).hex()
+        encoded[key] = value
+    return json.dumps(encoded, separators=(',', ':'))
+
+
+def decodeLog(text):
+    '''
+        inverse of encodeLog, restoring the HexBytes fields web3 decoders expect
+    '''
+    log = json.loads(text)
+    log['topics'] = [HexBytes(topic) for topic in log['topics']]
+    for key in LOG_BYTES_FIELDS:
+        if log.get(key) is not None:
+            log[key] = HexBytes(log[key])
+    return AttributeDict(log)
+
+
+class SqliteCache:
+    '''
+        sqlite file shared between threads, one instance per path
+    '''
+    SCHEMA = ()
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self.lock, self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+    @classmethod
+    def open(cls, path):
+        key = (cls, os.path.abspath(path))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+
+class LogCache(SqliteCache):
+    '''
+        raw logs per (address, topics) plus the block ranges that were fully fetched,
+        so only never-seen ranges have to go to the node
+    '''
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS ranges (address TEXT, topics TEXT, start INTEGER, end INTEGER)',
+        'CREATE INDEX IF NOT EXISTS ranges_key ON ranges (address, topics, start)',
+        'CREATE TABLE IF NOT EXISTS logs (address TEXT, topics TEXT, block INTEGER, log_index INTEGER, log TEXT, '
+        'PRIMARY KEY (address, topics, block, log_index))',
+    )
+
+    @staticmethod
+    def key(address, topics):
+        return address.lower(), json.dumps(topics, separators=(',', ':'))
+
+    def covered_ranges(self, address, topics):
+        address, topics = self.key(address, topics)
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT start, end FROM ranges WHERE address = ? AND topics = ? ORDER BY start',
+                (address, topics)).fetchall()
+        return rows
+
+    def plan(self, address, topics, start, end):
+        '''
+            splits [start, end] into consecutive (start, end, is_cached) segments
+        '''
+        segments = []
+        cursor = start
+        for covered_start, covered_end in self.covered_ranges(address, topics):
+            if covered_end < cursor or covered_start > end:
+                continue
+            if covered_start > cursor:
+                segments.append((cursor, covered_start - 1, False))
+            segments.append((max(cursor, covered_start), min(covered_end, end), True))
+            cursor = min(covered_end, end) + 1
+            if cursor > end:
+                break
+        if cursor <= end:
+            segments.append((cursor, end, False))
+        return segments
+
+    def get_logs(self, address, topics, start, end):
+        address, topics = self.key(address, topics)
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT log FROM logs WHERE address = ? AND topics = ? AND block BETWEEN ? AND ? '
+                'ORDER BY block, log_index',
+                (address, topics, start, end)).fetchall()
+        return [decodeLog(log) for log, in rows]
+
+    def address_logs(self, address):
+        '''
+            every cached log of a contract whatever filter fetched it, once each, in block order
+        '''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT log FROM logs WHERE address = ? GROUP BY block, log_index ORDER BY block, log_index',
+                (address.lower(),)).fetchall()
+        return [decodeLog(log) for log, in rows]
+
+    def add_logs(self, address, topics, start, end, logs):
+        '''
+            stores the logs of a fully fetched window and marks it as covered
+        '''
+        address, topics = self.key(address, topics)
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?)',
+                [(address, topics, log['blockNumber'], log['logIndex'], encodeLog(log)) for log in logs])
+            # merge with any covered range touching [start, end]
+            overlapping = self.db.execute(
+                'SELECT rowid, start, end FROM ranges WHERE address = ? AND topics = ? AND start <= ? AND end >= ?',
+                (address, topics, end + 1, start - 1)).fetchall()
+            for rowid, covered_start, covered_end in overlapping:
+                start = min(start, covered_start)
+                end = max(end, covered_end)
+                self.db.execute('DELETE FROM ranges WHERE rowid = ?', (rowid,))
+            self.db.execute('INSERT INTO ranges VALUES (?, ?, ?, ?)', (address, topics, start, end))
+
+
+TX_CACHE_PATH = './cache/transactions.db'
+
+
+class TransactionCache(SqliteCache):
+    '''
+        transactions by hash, stored as raw bytes: 32 byte hash, 20 byte from / to and the calldata
+    '''
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS transactions (hash BLOB PRIMARY KEY, sender BLOB, receiver BLOB, input BLOB) '
+        'WITHOUT ROWID',
+    )
+    # sqlite caps the number of bound parameters per statement
+    QUERY_CHUNK = 500
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, hashes):
+        '''
+            takes 32 byte hashes and returns {hash: (from, to, input)} for the cached ones
+        '''
+        hashes = list(hashes)
+        found = {}
+        with self.lock:
+            for i in range(0, len(hashes), self.QUERY_CHUNK):
+                chunk = hashes[i:i + self.QUERY_CHUNK]
+                rows = self.db.execute(
+                    f'SELECT hash, sender, receiver, input FROM transactions WHERE hash IN ({",".join("?" * len(chunk))})',
+                    chunk).fetchall()
+                found.update((bytes(tx_hash), (sender, receiver, data)) for tx_hash, sender, receiver, data in rows)
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def add_many(self, transactions):
+        '''
+            takes (hash, from, to, input) byte tuples, to being None for contract creations
+        '''
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?)', transactions)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+CODE_CACHE_PATH = './cache/code.db'
+
+
+class CodeCache(SqliteCache):
+    '''
+        keccak of each address' bytecode as of a block, 20 byte address and 32 byte hash
+    '''
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS code (address BLOB, block INTEGER, hash BLOB, PRIMARY KEY (address, block)) '
+        'WITHOUT ROWID',
+    )
+    QUERY_CHUNK = 500
+
+    def get_many(self, addresses, block):
+        '''
+            takes 20 byte addresses and returns {address: code hash} for the cached ones
+        '''
+        addresses = list(addresses)
+        found = {}
+        with self.lock:
+            for i in range(0, len(addresses), self.QUERY_CHUNK):
+                chunk = addresses[i:i + self.QUERY_CHUNK]
+                rows = self.db.execute(
+                    f'SELECT address, hash FROM code WHERE block = ? AND address IN ({",".join("?" * len(chunk))})',
+                    [block, *chunk]).fetchall()
+                found.update((bytes(address), bytes(code_hash)) for address, code_hash in rows)
+        return found
+
+    def add_many(self, block, code_hashes):
+        '''
+            takes {address: code hash} as bytes
+        '''
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO code VALUES (?, ?, ?)',
+                [(address, block, code_hash) for address, code_hash in code_hashes.items()])
+
+
+HTTP_CACHE_PATH = './cache/http.db'
+
+
+class HttpCache(SqliteCache):
+    '''
+        last response body per url with its validators, for conditional requests
+    '''
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body TEXT)',
+    )
+
+    def get(self, url):
+        '''
+            returns (etag, last_modified, body) or None
+        '''
+        with self.lock:
+            return self.db.execute('SELECT etag, last_modified, body FROM pages WHERE url = ?', (url,)).fetchone()
+
+    def put(self, url, etag, last_modified, body):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', (url, etag, last_modified, body))
+
+
+def updateCodeDigest(digest, code):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        # nested functions are code objects whose repr holds a memory address
+        if isinstance(const, CodeType):
+            updateCodeDigest(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+def codeVersion(func):
+    '''
+        hash of a function's bytecode and constants, changes whenever its body does
+    '''
+    func = getattr(func, '__wrapped__', func)
+    digest = hashlib.sha256()
+    code = getattr(func, '__code__', None)
+    if code is None:
+        digest.update(getattr(func, '__qualname__', repr(func)).encode())
+    else:
+        updateCodeDigest(digest, code)
+    return digest.hexdigest()
+
+
+def fileDigest(path):
+    '''
+        sha256 of a file's contents, None when it does not exist. a directory
+        digests the names and contents of every file below it
+    '''
+    path = Path(path)
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    if path.is_dir():
+        for child in sorted(child for child in path.rglob('*') if child.is_file()):
+            digest.update(f'{child.relative_to(path).as_posix()}:{fileDigest(child)}'.encode())
+        return digest.hexdigest()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+CALL_CACHE_DIR = './cache/calls'
+
+
+def _jsonDefault(value):
+    if isinstance(value, bytes):
+        return '0x' + value.hex()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+def argsDigest(args, kwargs):
+    '''
+        hash of call arguments, dicts hashed in insertion order since that order is meaningful here
+    '''
+    payload = json.dumps([args, sorted(kwargs.items())], default=_jsonDefault, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _tomlCodec():
+    import toml
+    return '.toml', lambda value: toml.dumps(value).encode(), lambda data: toml.loads(data.decode())
+
+
+def _msgpackCodec():
+    import msgpack
+    return '.msgpack', lambda value: msgpack.packb(value), lambda data: msgpack.unpackb(data, strict_map_key=False)
+
+
+CODECS = {
+    'json': lambda: ('.json', lambda value: json.dumps(value, indent=2).encode(), json.loads),
+    'compact': lambda: ('.json', lambda value: json.dumps(value, separators=(',', ':')).encode(), json.loads),
+    'toml': _tomlCodec,
+    'pickle': lambda: ('.pickle', lambda value: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+    'msgpack': _msgpackCodec,
+}
+
+
+def evict(directory, max_entries=None, max_bytes=None):
+    '''
+        deletes the least recently used entries until directory is within both limits.
+        files sharing a key (a result and its outputs record) go together
+    '''
+    groups = {}
+    for entry in Path(directory).glob('*'):
+        groups.setdefault(entry.name.split('.')[0], []).append(entry)
+    groups = sorted(groups.values(), key=lambda files: max(entry.stat().st_mtime for entry in files))
+    total = sum(entry.stat().st_size for files in groups for entry in files)
+    while groups and (
+            (max_entries is not None and len(groups) > max_entries)
+            or (max_bytes is not None and total > max_bytes)):
+        for entry in groups.pop(0):
+            total -= entry.stat().st_size
+            entry.unlink()
+
+
+def outputsMatch(outputs, outputs_entry):
+    '''
+        whether every output exists with the digest recorded in outputs_entry
+    '''
+    if not outputs:
+        return True
+    if not outputs_entry.exists():
+        return False
+    recorded = json.loads(outputs_entry.read_text())
+    for output in outputs:
+        digest = recorded.get(str(output))
+        if digest is None or digest != fileDigest(output):
+            return False
+    return True
+
+
+def cached(path=None, codec=None, outputs=(), max_entries=8, max_bytes=1 << 30, cache_dir=CALL_CACHE_DIR):
+    '''
+        caches a function's result under a key made of its arguments and code version,
+        so a changed input or a changed function body is a miss instead of a stale hit.
+        codec is json, compact, toml, pickle or msgpack (default from path's suffix, else json).
+        path, when given, also receives a copy of the latest result. the digests of the
+        files in outputs are recorded with the result and a hit needs them unchanged, so
+        outputs since rewritten by a call with other arguments make it a miss. each
+        function keeps at most max_entries results / max_bytes on disk, least recently used first out
+    '''
+    path = Path(path) if path is not None else None
+    if codec is None:
+        codec = {'.toml': 'toml', '.json': 'json', '.msgpack': 'msgpack', '.pickle': 'pickle'}.get(
+            path.suffix if path is not None else '', 'json')
+    suffix, dumps, loads = CODECS[codec]()
+
+    def decorator(func):
+        directory = Path(cache_dir) / f'{func.__module__}.{func.__qualname__}'
+        version = codeVersion(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = hashlib.sha256(f'{version}:{argsDigest(args, kwargs)}'.encode()).hexdigest()
+            entry = directory / f'{key}{suffix}'
+            outputs_entry = directory / f'{key}.outputs.json'
+            if entry.exists() and outputsMatch(outputs, outputs_entry):
+                print('load from cache', entry)
+                os.utime(entry)
+                return loads(entry.read_bytes())
+            result = func(*args, **kwargs)
+            data = dumps(result)
+            os.makedirs(directory, exist_ok=True)
+            tmp_entry = entry.with_name(entry.name + '.tmp')
+            tmp_entry.write_bytes(data)
+            os.replace(tmp_entry, entry)
+            if outputs:
+                tmp_entry = outputs_entry.with_name(outputs_entry.name + '.tmp')
+                tmp_entry.write_text(json.dumps({str(output): fileDigest(output) for output in outputs}))
+                os.replace(tmp_entry, outputs_entry)
+            if path is not None:
+                os.makedirs(path.parent, exist_ok=True)
+                path.write_bytes(data)
+            evict(directory, max_entries, max_bytes)
+            print('write to cache', entry)
+            return result
+
+        return wrapper
+
+    return decorator
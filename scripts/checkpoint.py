@@ -0,0 +1,62 @@
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+from .cache import codeVersion
+
+
+CHECKPOINT_DIR = './cache/checkpoints'
+
+
+class Checkpoint:
+    '''
+        periodically saves a scraper's Counter together with the last block whose logs
+        were all processed, so an interrupted scrape resumes from there. a checkpoint
+        written by a different version of the scraper or for other block bounds is ignored
+    '''
+    def __init__(self, name, scraper, startBlock, endBlock, every=60, directory=CHECKPOINT_DIR):
+        self.path = Path(directory) / f'{name}.json'
+        self.version = f'{codeVersion(scraper)}:{startBlock}:{endBlock}'
+        self.startBlock = startBlock
+        self.every = every
+        self.block = startBlock - 1
+        self.current_block = None
+        self.saved_at = time.monotonic()
+
+    def load(self, counter=None):
+        '''
+            returns (first block still to scrape, counter restored from the checkpoint)
+        '''
+        counter = counter if counter is not None else Counter()
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+            if state['version'] == self.version:
+                counter.update(state['counter'])
+                self.block = state['block']
+                print(f"resuming {self.path.stem} after block {self.block}")
+        return self.block + 1, counter
+
+    def save(self, block, counter):
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'version': self.version, 'block': block, 'counter': counter}))
+        os.replace(tmp_path, self.path)
+        self.block = block
+        self.saved_at = time.monotonic()
+
+    def advance(self, block, counter):
+        '''
+            call before processing each log of block, in block order. once every
+            seconds it saves counter as of the end of the previous block
+        '''
+        if block == self.current_block:
+            return
+        self.current_block = block
+        if block - 1 > self.block and time.monotonic() - self.saved_at >= self.every:
+            self.save(block - 1, counter)
+
+    def complete(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,85 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from .addresses import toAddressBytes
+from .table import searchSorted
+
+
+'''
+Claims store layout, all integers big endian:
+    header   magic b'CLAIMS01', claim count uint64, merkle root 32 bytes, index offset uint64
+    proofs   every proof's 32 byte nodes back to back
+    index    claim count records sorted by address:
+             address 20 bytes, index uint32, amount uint256, proof offset uint64, proof length uint8
+'''
+
+CLAIMS_MAGIC = b'CLAIMS01'
+HEADER = struct.Struct('>8sQ32sQ')
+RECORD = struct.Struct('>20sI32sQB')
+NODE_SIZE = 32
+
+
+def writeClaimsStore(path, tree):
+    '''
+        writes the claims of a MerkleDistribution as an address sorted claims store
+    '''
+    os.makedirs(Path(path).parent, exist_ok=True)
+    order = sorted(range(len(tree.claims)), key=lambda i: toAddressBytes(tree.claims[i][1]))
+    records = []
+    with open(path, 'wb') as fp:
+        fp.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for i, proof in zip(order, tree.iter_claim_proofs(order)):
+            index, account, amount = tree.claims[i]
+            proof = b''.join(bytes.fromhex(node[2:]) for node in proof)
+            fp.write(proof)
+            records.append(RECORD.pack(
+                toAddressBytes(account), index, amount.to_bytes(32, 'big'), offset, len(proof) // NODE_SIZE))
+            offset += len(proof)
+        index_offset = offset
+        fp.write(b''.join(records))
+        fp.seek(0)
+        fp.write(HEADER.pack(CLAIMS_MAGIC, len(records), bytes(tree.root), index_offset))
+
+
+class ClaimsStore:
+    '''
+        memory mapped claims store, each lookup is a binary search over the index.
+        read only, so any number of processes can share the page cache
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, root, self.index_offset = HEADER.unpack_from(self.buffer, 0)
+        if magic != CLAIMS_MAGIC:
+            raise ValueError(f"{path} is not a claims store")
+        self.merkle_root = '0x' + root.hex()
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, address):
+        '''
+            returns {'index', 'amount', 'proof'} like a distribution json claim, None if absent
+        '''
+        position = searchSorted(self.buffer, self.index_offset, self.count, RECORD.size, toAddressBytes(address))
+        if position < 0:
+            return None
+        _, index, amount, proof_offset, proof_length = RECORD.unpack_from(
+            self.buffer, self.index_offset + position * RECORD.size)
+        proof = [
+            '0x' + self.buffer[start:start + NODE_SIZE].hex()
+            for start in range(proof_offset, proof_offset + proof_length * NODE_SIZE, NODE_SIZE)
+        ]
+        return {'index': index, 'amount': hex(int.from_bytes(amount, 'big')), 'proof': proof}
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,3 +1,8 @@
+from enum import Flag
+
+from .addresses import toAddressBytes
+
+
 ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
 
 CURVE_ADAPTERS = [
@@ -580,4 +585,59 @@ NO_ABI_AVAILABLE = [
     '0x40DDE6092a77eC2d00eB4fa14f0c5d92d835d673'
 ]
 
-SKIP_ADDRESSES = NO_ABI_AVAILABLE + UNABLE_TO_DECODE
\ No newline at end of file
+SKIP_ADDRESSES = NO_ABI_AVAILABLE + UNABLE_TO_DECODE
+
+
+class AddressCategory(Flag):
+    NONE = 0
+    CURVE_ADAPTER = 1
+    INSTACCOUNT = 2
+    ARGENT = 4
+    ARGENT_UNISWAP = 8
+    ZAPPER = 16
+    ZERION = 32
+    UNABLE_TO_DECODE = 64
+    UNI_UNDECODABLE = 128
+    NO_ABI_AVAILABLE = 256
+    SKIP = NO_ABI_AVAILABLE | UNABLE_TO_DECODE
+    # curve LP receivers whose user is decoded from the calldata, amount from the log
+    CURVE_WALLET = CURVE_ADAPTER | INSTACCOUNT | ARGENT
+    # uniswap LP providers whose user is decoded from the calldata
+    UNISWAP_WALLET = ARGENT_UNISWAP | ZAPPER
+
+
+CATEGORY_LISTS = (
+    (CURVE_ADAPTERS, AddressCategory.CURVE_ADAPTER),
+    (INSTACCOUNT, AddressCategory.INSTACCOUNT),
+    (ARGENT, AddressCategory.ARGENT),
+    (ARGENT_UNISWAP, AddressCategory.ARGENT_UNISWAP),
+    (ZAPPER, AddressCategory.ZAPPER),
+    (ZERION, AddressCategory.ZERION),
+    (UNABLE_TO_DECODE, AddressCategory.UNABLE_TO_DECODE),
+    (UNI_UNDECODABLE, AddressCategory.UNI_UNDECODABLE),
+    (NO_ABI_AVAILABLE, AddressCategory.NO_ABI_AVAILABLE),
+)
+
+
+def buildAddressIndex(category_lists):
+    '''
+        20 byte address -> every category it is listed under
+    '''
+    index = {}
+    for addresses, category in category_lists:
+        for address in addresses:
+            key = toAddressBytes(address)
+            index[key] = index.get(key, AddressCategory.NONE) | category
+    return index
+
+
+ADDRESS_INDEX = buildAddressIndex(CATEGORY_LISTS)
+
+
+def classify(address):
+    '''
+        categories of an address in any casing, AddressCategory.NONE when unlisted or None
+    '''
+    if address is None:
+        return AddressCategory.NONE
+    return ADDRESS_INDEX.get(toAddressBytes(address), AddressCategory.NONE)
@@ -0,0 +1,173 @@
+import json
+import os
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from eth_hash.auto import keccak as keccak256
+
+from .addresses import toChecksum
+from .bytecode import CODE, EMPTY_CODE_HASH
+from .cache import LogCache, LOG_CACHE_PATH
+from .constants import ADDRESS_INDEX, CATEGORY_LISTS, AddressCategory, classify
+from .transactions import TRANSACTIONS, txKey
+from .utils import DECODERS, toCalldata
+
+
+DISCOVERY_FILE = 'snapshot/discovery.json'
+# transactions looked at per unknown receiver
+TX_SAMPLE = 5
+
+
+def eventTopic(signature):
+    return '0x' + keccak256(signature.encode()).hex()
+
+
+ZERO_TOPIC = '0x' + bytes(32).hex()
+
+# the logs each scraper in snapshot.py routes by receiver: contract, topics the log
+# starts with, topic holding the receiver, the block the scrape ends at, and what
+# to propose for a receiver whose calls all decode / none decode
+DISCOVERY_SOURCES = {
+    'renbtc_mint': {
+        'address': '0xe4b679400F0f267212D5D812B95f58C83243EE71',
+        'topics': [eventTopic('LogMint(address,uint256,uint256,bytes32)')],
+        'receiver_topic': 1,
+        'block': 11285016,
+        'decodable': None,
+        'undecodable': AddressCategory.UNABLE_TO_DECODE,
+    },
+    'sbtc_lp': {
+        'address': '0x075b1bb99792c9E1041bA13afEf80C91a1e70fB3',
+        'topics': [eventTopic('Transfer(address,address,uint256)')],
+        'receiver_topic': 2,
+        'block': 11285016,
+        'decodable': AddressCategory.CURVE_ADAPTER,
+        'undecodable': None,
+    },
+    'renbtc_lp': {
+        'address': '0x49849C98ae39Fff122806C06791Fa73784FB3675',
+        'topics': [eventTopic('Transfer(address,address,uint256)')],
+        'receiver_topic': 2,
+        'block': 11285016,
+        'decodable': AddressCategory.CURVE_ADAPTER,
+        'undecodable': None,
+    },
+    'uniswap': {
+        'address': '0xBb2b8038a1640196FbE3e38816F3e67Cba72D940',
+        'topics': [eventTopic('Transfer(address,address,uint256)'), ZERO_TOPIC],
+        'receiver_topic': 2,
+        'block': 11304643,
+        'decodable': AddressCategory.ZAPPER,
+        'undecodable': AddressCategory.UNI_UNDECODABLE,
+    },
+}
+
+
+def unknownReceivers(source, log_cache):
+    '''
+        unlisted receivers of a source's cached logs -> their transaction hashes
+    '''
+    receivers = defaultdict(list)
+    prefix = source['topics']
+    for log in log_cache.address_logs(source['address']):
+        topics = ['0x' + bytes(topic).hex() for topic in log['topics']]
+        if topics[:len(prefix)] != prefix or len(topics) <= source['receiver_topic']:
+            continue
+        receiver = bytes.fromhex(topics[source['receiver_topic']][2:])[12:]
+        if classify(receiver) == AddressCategory.NONE:
+            receivers[receiver].append(log['transactionHash'])
+    return receivers
+
+
+def categoryNames(category):
+    return [listed.name for _, listed in CATEGORY_LISTS if category & listed]
+
+
+def parserDefinition(selector):
+    parser = DECODERS.parsers.get(selector)
+    return parser.definition if parser is not None else None
+
+
+def decodes(tx):
+    try:
+        return DECODERS.decode(tx) is not None
+    except Exception:
+        # calldata that matches a known selector but not its arguments
+        return False
+
+
+def discover(source_names=None, log_cache_path=LOG_CACHE_PATH, tx_sample=TX_SAMPLE):
+    '''
+        clusters the unknown contract receivers of every source by bytecode hash and
+        proposes a category per cluster: the categories of listed addresses running
+        the same code, else by whether the sampled calls decode with a known parser
+    '''
+    log_cache = LogCache.open(log_cache_path)
+    report = {}
+    for name in source_names or DISCOVERY_SOURCES:
+        source = DISCOVERY_SOURCES[name]
+        receivers = unknownReceivers(source, log_cache)
+        block = source['block']
+        # one sweep over the unknown receivers and the listed addresses to compare them with
+        code_hashes = CODE.get_many(list(receivers) + list(ADDRESS_INDEX), block)
+        known_by_code = defaultdict(lambda: AddressCategory.NONE)
+        for address, category in ADDRESS_INDEX.items():
+            if code_hashes[address] != EMPTY_CODE_HASH:
+                known_by_code[code_hashes[address]] |= category
+
+        contracts = [address for address in receivers if code_hashes[address] != EMPTY_CODE_HASH]
+        samples = {address: receivers[address][:tx_sample] for address in contracts}
+        transactions = TRANSACTIONS.get_many(txid for txids in samples.values() for txid in txids)
+
+        clusters = defaultdict(lambda: {'addresses': [], 'logs': 0, 'selectors': Counter(), 'decoded': 0, 'sampled': 0})
+        for address in contracts:
+            cluster = clusters[code_hashes[address]]
+            cluster['addresses'].append(toChecksum(address))
+            cluster['logs'] += len(receivers[address])
+            for txid in samples[address]:
+                tx = transactions[txKey(txid)]
+                data = toCalldata(tx.input)
+                cluster['selectors'][data[:4]] += 1
+                cluster['sampled'] += 1
+                cluster['decoded'] += decodes(tx)
+
+        proposals = []
+        for code_hash, cluster in sorted(clusters.items(), key=lambda item: -item[1]['logs']):
+            if code_hash in known_by_code:
+                proposal = known_by_code[code_hash]
+                reason = 'same bytecode as listed addresses'
+            elif cluster['sampled'] and cluster['decoded'] == cluster['sampled']:
+                proposal = source['decodable']
+                reason = 'every sampled call decodes'
+            elif cluster['sampled'] and cluster['decoded'] == 0:
+                proposal = source['undecodable']
+                reason = 'no sampled call decodes'
+            else:
+                proposal = None
+                reason = 'needs review'
+            proposals.append({
+                'code_hash': '0x' + code_hash.hex(),
+                'proposal': categoryNames(proposal) if proposal else [],
+                'reason': reason,
+                'addresses': cluster['addresses'],
+                'logs': cluster['logs'],
+                'selectors': {
+                    '0x' + selector.hex(): {'calls': n, 'parser': parserDefinition(selector)}
+                    for selector, n in cluster['selectors'].most_common()
+                },
+            })
+        print(f"{name}: {len(receivers)} unknown receivers, {len(contracts)} contracts in {len(proposals)} code clusters")
+        report[name] = proposals
+    return report
+
+
+def main(out_file_name=DISCOVERY_FILE):
+    '''
+        brownie run discovery --network archive
+        reads the log cache left by a snapshot run, proposals go to snapshot/discovery.json
+    '''
+    report = discover()
+    os.makedirs(Path(out_file_name).parent, exist_ok=True)
+    with open(out_file_name, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print('write to', out_file_name)
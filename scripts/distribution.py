@@ -1,29 +1,95 @@
-import json
+import os
+import random
 from brownie import MerkleDistributor, accounts, interface
 
+from .verify import benchmark, loadDistribution, verifyDistribution
 
-def main():
-    with open('snapshot/07-merkle-distribution.json') as fp:
-        tree = json.load(fp)
 
-    ychad = accounts.at("0xFEB4acf3df3cDEA7399794D0869ef76A6EfAff52")
+DISTRIBUTION_FILE = 'snapshot/08-merkle-distribution.json'
+DAI_ADDRESS = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+YCHAD_ADDRESS = '0xFEB4acf3df3cDEA7399794D0869ef76A6EfAff52'
+# makerdao multicall, https://etherscan.io/address/0xeefBa1e63905eF1D7ACbA5a8513c70307C1cE441
+MULTICALL_ADDRESS = '0xeefBa1e63905eF1D7ACbA5a8513c70307C1cE441'
+# balanceOf reads per aggregate call
+READ_BATCH = 500
+# claims per aggregate transaction, kept well under the block gas limit
+CLAIM_BATCH = 100
 
-    dai = interface.ERC20('0x6B175474E89094C44Da98b954EedeAC495271d0F')
+
+def balancesOf(token, addresses, batch_size=READ_BATCH):
+    multicall = interface.Multicall(MULTICALL_ADDRESS)
+    balances = []
+    for i in range(0, len(addresses), batch_size):
+        calls = [(token.address, token.balanceOf.encode_input(address)) for address in addresses[i:i + batch_size]]
+        _, results = multicall.aggregate.call(calls)
+        balances.extend(token.balanceOf.decode_output(data) for data in results)
+    return balances
+
+
+def verify_offline(fn=DISTRIBUTION_FILE):
+    '''
+        checks every proof against the root on all cores, no rpc needed
+    '''
+    tree = loadDistribution(fn)
+    problems = verifyDistribution(tree, processes=os.cpu_count())
+    for problem in problems:
+        print(problem)
+    assert not problems
+    print(f"all {len(tree['claims'])} proofs lead to {tree['merkleRoot']}")
+
+
+def verify_on_fork(fn=DISTRIBUTION_FILE, sample=0):
+    '''
+        deploys the distributor on a fork and claims either every entry or a random
+        sample of them, CLAIM_BATCH claims per multicall transaction. balances are
+        read before and after in multicall batches as well
+    '''
+    tree = loadDistribution(fn)
+
+    ychad = accounts.at(YCHAD_ADDRESS)
+
+    dai = interface.ERC20(DAI_ADDRESS)
     distributor = MerkleDistributor.deploy(dai, tree['merkleRoot'], {'from': ychad})
 
     dai.transfer(distributor, tree['tokenTotal'], {'from': ychad})
 
-    for i, (address, claim) in enumerate(tree['claims'].items()):
-        if not i % 50:
-            print(f"Distribution in progress, {i} / {len(tree['claims'])}...")
+    claims = list(tree['claims'].items())
+    if sample:
+        claims = random.sample(claims, min(sample, len(claims)))
+    addresses = [address for address, _ in claims]
+    before = balancesOf(dai, addresses)
+
+    multicall = interface.Multicall(MULTICALL_ADDRESS)
+    for i in range(0, len(claims), CLAIM_BATCH):
+        print(f"Distribution in progress, {i} / {len(claims)}...")
+        calls = [
+            (distributor.address, distributor.claim.encode_input(claim['index'], address, claim['amount'], claim['proof'], 0))
+            for address, claim in claims[i:i + CLAIM_BATCH]
+        ]
+        multicall.aggregate(calls, {'from': ychad})
+
+    after = balancesOf(dai, addresses)
+    for (address, claim), balance, new_balance in zip(claims, before, after):
+        assert new_balance == balance + int(claim['amount'], 16), address
 
-        balance = dai.balanceOf(address)
-        distributor.claim(
-            claim['index'], address, claim['amount'], claim['proof'], 0, {'from': ychad}
-        )
+    if not sample:
+        assert dai.balanceOf(distributor) == 0
 
-        assert dai.balanceOf(address) == balance + claim['amount']
+    print(f"Distribution of {len(claims)} claims was successful!")
 
-    assert dai.balanceOf(distributor) == 0
 
-    print("Distribution was successful!")
\ No newline at end of file
+def main(mode='offline', sample=0, fn=DISTRIBUTION_FILE):
+    '''
+        brownie run distribution                                        # every proof, offline
+        brownie run distribution main fork 200 --network mainnet-fork   # 200 random claims on a fork
+        brownie run distribution main fork --network mainnet-fork       # every claim on a fork
+        brownie run distribution main benchmark                         # offline verifications/sec
+    '''
+    if mode == 'offline':
+        verify_offline(fn)
+    elif mode == 'fork':
+        verify_on_fork(fn, int(sample))
+    elif mode == 'benchmark':
+        benchmark(loadDistribution(fn), processes=os.cpu_count())
+    else:
+        raise ValueError(f"unknown mode {mode}, expected offline, fork or benchmark")
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import random
+
+import aiohttp
+
+from .cache import HttpCache, HTTP_CACHE_PATH
+from .reporting import REPORTER
+from .utils import SnapShotScraper, timestamp_to_datetime
+
+
+# statuses worth another attempt, everything else >= 400 is raised at once
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncSnapShotScraper(SnapShotScraper):
+    '''
+        SnapShotScraper fetching proposals concurrently over one pooled connection set.
+        at most max_concurrency requests are in flight, failed ones are retried with
+        jittered exponential backoff, and pages already seen are revalidated with
+        If-None-Match / If-Modified-Since so unchanged proposals cost a 304
+    '''
+    def __init__(self, key, cutoff, participants=None, debug=False, base_url='https://hub.snapshot.page',
+                 max_concurrency=32, retries=5, backoff=0.5, timeout=30, cache_path=HTTP_CACHE_PATH):
+        super().__init__(key, cutoff, participants=participants, debug=debug, base_url=base_url)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = HttpCache.open(cache_path) if cache_path is not None else None
+
+    async def get_page(self, session, semaphore, url):
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore, session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached is not None:
+                        REPORTER.count('hub.not_modified')
+                        return json.loads(cached[2])
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        body = await response.text()
+                        REPORTER.count('hub.fetched')
+                        if self.cache is not None:
+                            self.cache.put(
+                                url, response.headers.get('ETag'), response.headers.get('Last-Modified'), body)
+                        return json.loads(body)
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt == self.retries:
+                raise error
+            REPORTER.count('hub.retried')
+            await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    async def scrape_async(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            proposals = await self.get_page(session, semaphore, self.getProposalsListUrl())
+            selected = []
+            for snapshot_id, value in proposals.items():
+                timestamp = timestamp_to_datetime(value['msg']['timestamp'])
+                if timestamp > self.cutoff:
+                    if self.debug:
+                        print(f"{snapshot_id} {timestamp} is after cutoff date of {self.cutoff}")
+                    continue
+                if self.debug:
+                    print(f"Proposal {snapshot_id} on {timestamp} by {value['address']}")
+                selected.append((snapshot_id, value))
+            pages = await asyncio.gather(*(
+                self.get_page(session, semaphore, self.getProposalUrl(snapshot_id)) for snapshot_id, _ in selected
+            ))
+        # credited in proposal order so the output matches the sequential scrape
+        for (_, value), votes in zip(selected, pages):
+            self.participants[value['address']] += 1
+            for voter in votes.keys():
+                self.participants[voter] += 1
+        REPORTER.summary('hub.')
+        return self.participants
+
+    def scrape(self):
+        return asyncio.run(self.scrape_async())
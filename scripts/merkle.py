@@ -0,0 +1,264 @@
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from eth_abi.packed import encode_abi_packed
+from eth_hash.auto import keccak as keccak256
+
+from .utils import MerkleTree
+
+
+# leaves per process pool shard, a power of two so shard subtrees line up with the full tree
+SHARD_SIZE = 2 ** 14
+
+
+def claimLeaf(index, account, amount):
+    return keccak256(encode_abi_packed(['uint', 'address', 'uint'], (index, account, amount)))
+
+
+def hashClaims(claims):
+    '''
+        takes (index, account, amount) tuples and returns their leaf hashes
+    '''
+    return [claimLeaf(*claim) for claim in claims]
+
+
+def buildSubtree(leaves, depth):
+    '''
+        the first depth layers above a shard of leaves
+    '''
+    layers = []
+    layer = leaves
+    for _ in range(depth):
+        layer = MerkleTree.get_next_layer(layer)
+        layers.append(layer)
+    return layers
+
+
+def buildLayers(leaves, processes=None):
+    '''
+        builds every layer over a buffer of sorted leaves. with processes the bottom
+        of the tree is hashed in SHARD_SIZE subtrees on a process pool; above that
+        the layers are small enough to finish serially
+    '''
+    count = len(leaves) // 32
+    if not processes or count <= SHARD_SIZE:
+        return MerkleTree.get_layers(leaves)
+    depth = SHARD_SIZE.bit_length() - 1
+    shards = [leaves[i:i + SHARD_SIZE * 32] for i in range(0, len(leaves), SHARD_SIZE * 32)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        subtrees = list(pool.map(buildSubtree, shards, [depth] * len(shards)))
+    layers = [leaves] + [b''.join(subtree[level] for subtree in subtrees) for level in range(depth)]
+    while len(layers[-1]) > 32:
+        layers.append(MerkleTree.get_next_layer(layers[-1]))
+    return layers
+
+
+class MerkleDistribution(MerkleTree):
+    '''
+        merkle tree over (index, account, amount) claims that can be saved and
+        reloaded, so an unchanged distribution is never rehashed
+    '''
+    def __init__(self, claims, leaves_by_index, layers):
+        self.claims = claims
+        self.leaves_by_index = leaves_by_index
+        self.layers = layers
+        self.elements = [layers[0][i:i + 32] for i in range(0, len(layers[0]), 32)]
+        self.leaf_index = {leaf: i for i, leaf in enumerate(self.elements)}
+
+    @classmethod
+    def build(cls, balances, processes=None, known_leaves=None):
+        '''
+            known_leaves maps (index, account, amount) to a leaf hashed earlier, only
+            the claims missing from it are hashed
+        '''
+        claims = [(index, account, amount) for index, (account, amount) in enumerate(balances.items())]
+        known_leaves = known_leaves or {}
+        missing = [claim for claim in claims if claim not in known_leaves]
+        if processes and len(missing) > SHARD_SIZE:
+            chunks = [missing[i:i + SHARD_SIZE] for i in range(0, len(missing), SHARD_SIZE)]
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                hashed = [leaf for chunk in pool.map(hashClaims, chunks) for leaf in chunk]
+        else:
+            hashed = hashClaims(missing)
+        leaves = {**known_leaves, **dict(zip(missing, hashed))}
+        leaves_by_index = [leaves[claim] for claim in claims]
+        layers = buildLayers(b''.join(sorted(set(leaves_by_index))), processes)
+        return cls(claims, leaves_by_index, layers)
+
+    def iter_claim_proofs(self, order=None, chunk_size=SHARD_SIZE):
+        '''
+            yields the proofs of the claims at the indices in order, claim index order by
+            default. chunk_size proofs at a time are built in one pass, so memory stays bounded
+        '''
+        order = range(len(self.claims)) if order is None else order
+        for start in range(0, len(order), chunk_size):
+            yield from self.get_proofs_at(
+                [self.leaf_index[self.leaves_by_index[i]] for i in order[start:start + chunk_size]])
+
+    def save(self, path):
+        '''
+            writes claims.json, leaves.bin (leaf hashes in claim index order) and
+            layers.bin (layer count, then each layer length prefixed)
+        '''
+        path = Path(path)
+        os.makedirs(path, exist_ok=True)
+        (path / 'claims.json').write_text(json.dumps([[account, hex(amount)] for _, account, amount in self.claims]))
+        (path / 'leaves.bin').write_bytes(b''.join(self.leaves_by_index))
+        with open(path / 'layers.bin', 'wb') as fp:
+            fp.write(struct.pack('>Q', len(self.layers)))
+            for layer in self.layers:
+                fp.write(struct.pack('>Q', len(layer)))
+                fp.write(layer)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        claims = [
+            (index, account, int(amount, 16))
+            for index, (account, amount) in enumerate(json.loads((path / 'claims.json').read_text()))
+        ]
+        with open(path / 'layers.bin', 'rb') as fp:
+            layer_count, = struct.unpack('>Q', fp.read(8))
+            layers = []
+            for _ in range(layer_count):
+                size, = struct.unpack('>Q', fp.read(8))
+                layers.append(fp.read(size))
+        leaves = (path / 'leaves.bin').read_bytes()
+        leaves_by_index = [leaves[i:i + 32] for i in range(0, len(leaves), 32)]
+        return cls(claims, leaves_by_index, layers)
+
+    @classmethod
+    def open(cls, path, balances, processes=None):
+        '''
+            the tree for balances, reusing the one saved at path as it is when its claims
+            are unchanged. otherwise the layers are rebuilt: leaves are sorted by hash, so
+            a single changed amount can move every node above it. only the leaves of
+            unchanged claims are reused. returns (tree, diff) where diff lists the added,
+            removed and changed accounts, None when nothing was saved
+        '''
+        if not (Path(path) / 'layers.bin').exists():
+            tree = cls.build(balances, processes)
+            tree.save(path)
+            return tree, None
+        saved = cls.load(path)
+        claims = [(index, account, amount) for index, (account, amount) in enumerate(balances.items())]
+        if claims == saved.claims:
+            return saved, {'added': [], 'removed': [], 'changed': []}
+        tree = cls.build(balances, processes, known_leaves=dict(zip(saved.claims, saved.leaves_by_index)))
+        tree.save(path)
+        old_claims = {account: (index, amount) for index, account, amount in saved.claims}
+        accounts = {account for _, account, _ in claims}
+        diff = {
+            'added': [account for _, account, _ in claims if account not in old_claims],
+            'removed': [account for account in old_claims if account not in accounts],
+            'changed': [
+                account for index, account, amount in claims
+                if account in old_claims and old_claims[account] != (index, amount)
+            ],
+        }
+        return tree, diff
+
+
+class DistributionWriter:
+    '''
+        writes a distribution json one claim at a time. with an indent the output
+        matches json.dumps(distribution, indent=indent), without one it is compact.
+        claims go to <path>.tmp, which only replaces path once the writer is closed
+        without an error
+    '''
+    def __init__(self, path, merkle_root, token_total, indent=2):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.fp = open(self.tmp_path, 'w')
+        self.indent = indent
+        self.count = 0
+        if indent is None:
+            self.fp.write(f'{{"merkleRoot":{json.dumps(merkle_root)},"tokenTotal":{json.dumps(token_total)},"claims":{{')
+        else:
+            pad = ' ' * indent
+            self.fp.write(f'{{\n{pad}"merkleRoot": {json.dumps(merkle_root)},\n'
+                          f'{pad}"tokenTotal": {json.dumps(token_total)},\n{pad}"claims": {{')
+
+    def write_claim(self, user, claim):
+        if self.indent is None:
+            self.fp.write(f'{"," if self.count else ""}{json.dumps(user)}:{json.dumps(claim, separators=(",", ":"))}')
+        else:
+            pad = ' ' * (self.indent * 2)
+            body = json.dumps(claim, indent=self.indent).replace('\n', '\n' + pad)
+            self.fp.write(f'{"," if self.count else ""}\n{pad}{json.dumps(user)}: {body}')
+        self.count += 1
+
+    def finish(self):
+        '''
+            completes the json in the temporary file, path is left untouched
+        '''
+        if self.fp.closed:
+            return
+        if self.indent is None:
+            self.fp.write('}}')
+        else:
+            closing = f'\n{" " * self.indent}}}' if self.count else '}'
+            self.fp.write(f'{closing}\n}}')
+        self.fp.close()
+
+    def commit(self):
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.fp.close()
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+
+    def close(self):
+        self.finish()
+        self.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def shardPath(path, shard):
+    path = Path(path)
+    return path.with_name(f'{path.stem}-{shard:04d}{path.suffix}')
+
+
+def writeDistribution(path, tree, indent=2, shard_size=None):
+    '''
+        streams every claim of a MerkleDistribution to path, generating the proofs
+        a chunk at a time as they are written. with shard_size the claims are also split across
+        <stem>-0000.json, <stem>-0001.json, ... each holding root, total and its claims.
+        no file is replaced unless every one of them was written in full
+    '''
+    merkle_root = '0x' + tree.root.hex()
+    token_total = hex(sum(amount for _, _, amount in tree.claims))
+    os.makedirs(Path(path).parent, exist_ok=True)
+    writer = DistributionWriter(path, merkle_root, token_total, indent)
+    shards = []
+    try:
+        for (index, account, amount), proof in zip(tree.claims, tree.iter_claim_proofs()):
+            claim = {'index': index, 'amount': hex(amount), 'proof': proof}
+            writer.write_claim(account, claim)
+            if shard_size:
+                if index % shard_size == 0:
+                    if shards:
+                        shards[-1].finish()
+                    shards.append(DistributionWriter(shardPath(path, index // shard_size), merkle_root, token_total, indent))
+                shards[-1].write_claim(account, claim)
+        for part in [writer] + shards:
+            part.finish()
+    except BaseException:
+        for part in [writer] + shards:
+            part.discard()
+        raise
+    for part in shards + [writer]:
+        part.commit()
+    return {'merkleRoot': merkle_root, 'tokenTotal': token_total, 'claims': writer.count}
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from .cache import codeVersion, fileDigest
+
+
+PIPELINE_STATE_PATH = './cache/pipeline.json'
+
+
+class Stage:
+    '''
+        one step of the pipeline. func is called with the results of deps (in order)
+        followed by args. a stage with a load function and outputs can be skipped:
+        when its outputs exist and its fingerprint (code, args, input files and
+        upstream fingerprints) is unchanged, load() supplies its result instead
+    '''
+    def __init__(self, name, func, args=(), deps=(), inputs=(), outputs=(), load=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.deps = tuple(deps)
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.load = load
+
+    def fingerprint(self, dep_fingerprints):
+        digest = hashlib.sha256()
+        digest.update(codeVersion(self.func).encode())
+        digest.update(repr(self.args).encode())
+        for path in self.inputs:
+            digest.update(f'{path}:{fileDigest(path)}'.encode())
+        for fingerprint in dep_fingerprints:
+            digest.update(fingerprint.encode())
+        return digest.hexdigest()
+
+    def is_fresh(self, fingerprint, state, upstream_ran=False):
+        # outputs from before the pipeline kept any state are adopted as they are,
+        # but never on top of an upstream stage that just produced new results
+        return (
+            self.load is not None
+            and not upstream_ran
+            and state.get(self.name, fingerprint) == fingerprint
+            and all(Path(path).exists() for path in self.outputs)
+        )
+
+
+class Pipeline:
+    '''
+        runs stages in dependency order, independent stages concurrently on a thread pool
+    '''
+    def __init__(self, stages, max_workers=5, state_path=PIPELINE_STATE_PATH):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        self.state_path = Path(state_path)
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"stage {stage.name} depends on unknown stage {dep}")
+        self.check_cycles()
+
+    def check_cycles(self):
+        '''
+            raises ValueError naming the stages of the first dependency cycle found
+        '''
+        done = set()
+        for name in self.stages:
+            if name in done:
+                continue
+            path = [name]
+            on_path = {name}
+            stack = [(name, iter(self.stages[name].deps))]
+            while stack:
+                node, deps = stack[-1]
+                dep = next(deps, None)
+                if dep is None:
+                    stack.pop()
+                    path.pop()
+                    on_path.discard(node)
+                    done.add(node)
+                elif dep in on_path:
+                    cycle = path[path.index(dep):] + [dep]
+                    raise ValueError(f"dependency cycle: {' -> '.join(cycle)}")
+                elif dep not in done:
+                    stack.append((dep, iter(self.stages[dep].deps)))
+                    path.append(dep)
+                    on_path.add(dep)
+
+    def load_state(self):
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text())
+        return {}
+
+    def save_state(self, state):
+        os.makedirs(self.state_path.parent, exist_ok=True)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(state, indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    def required(self, targets):
+        '''
+            the target stages plus everything upstream of them
+        '''
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in required:
+                required.add(name)
+                pending.extend(self.stages[name].deps)
+        return required
+
+    def run(self, targets=None, force=()):
+        '''
+            runs targets (default every stage) and returns {stage name: result}.
+            stages named in force run even if their outputs look fresh
+        '''
+        names = self.required(targets or self.stages)
+        state = self.load_state()
+        results = {}
+        fingerprints = {}
+        ran = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(results) < len(names):
+                for name in sorted(names):
+                    stage = self.stages[name]
+                    if name in results or name in running.values() or any(dep not in results for dep in stage.deps):
+                        continue
+                    fingerprints[name] = stage.fingerprint(fingerprints[dep] for dep in stage.deps)
+                    upstream_ran = any(dep in ran for dep in stage.deps)
+                    if name not in force and stage.is_fresh(fingerprints[name], state, upstream_ran):
+                        print(f"[{name}] unchanged, loading {', '.join(map(str, stage.outputs))}")
+                        running[pool.submit(stage.load)] = name
+                    else:
+                        print(f"[{name}] running")
+                        ran.add(name)
+                        running[pool.submit(stage.func, *[results[dep] for dep in stage.deps], *stage.args)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    if self.stages[name].load is not None:
+                        state[name] = fingerprints[name]
+                        self.save_state(state)
+        return results
@@ -0,0 +1,92 @@
+import json
+import math
+import os
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from rich.console import Console
+
+console = Console()
+
+
+class Reporter:
+    '''
+        collects counters, log10 histograms and optional sampled detail records
+        instead of printing from hot loops. details go to a JSONL file, one in
+        every sample_every records per event name. the first record after a
+        configure starts the file over, so runs do not pile up in it
+    '''
+    def __init__(self, detail_path=None, sample_every=1):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+        self.seen = Counter()
+        self.sample_every = sample_every
+        self.detail_path = detail_path
+        self.detail_fp = None
+        self.detail_mode = 'w'
+
+    def configure(self, detail_path=None, sample_every=1):
+        with self.lock:
+            if self.detail_fp is not None:
+                self.detail_fp.close()
+                self.detail_fp = None
+            self.detail_path = detail_path
+            self.detail_mode = 'w'
+            self.sample_every = sample_every
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        '''
+            counts value into the histogram bucket of its power of ten
+        '''
+        bucket = int(math.log10(value)) if value > 0 else None
+        with self.lock:
+            self.histograms[name][bucket] += 1
+
+    def detail(self, name, **fields):
+        if self.detail_path is None:
+            return
+        with self.lock:
+            self.seen[name] += 1
+            if (self.seen[name] - 1) % self.sample_every:
+                return
+            if self.detail_fp is None:
+                os.makedirs(Path(self.detail_path).parent, exist_ok=True)
+                self.detail_fp = open(self.detail_path, self.detail_mode)
+                self.detail_mode = 'a'
+            self.detail_fp.write(json.dumps({'event': name, **fields}, default=str) + '\n')
+
+    def event(self, name, value=None, **fields):
+        '''
+            counts an occurrence, buckets value when given and records the details
+        '''
+        self.count(name)
+        if value is not None:
+            self.observe(name, value)
+        self.detail(name, **fields)
+
+    def summary(self, prefix=''):
+        '''
+            prints the counters and histograms whose name starts with prefix
+        '''
+        with self.lock:
+            counters = sorted((name, n) for name, n in self.counters.items() if name.startswith(prefix))
+            histograms = sorted((name, dict(h)) for name, h in self.histograms.items() if name.startswith(prefix))
+            if self.detail_fp is not None:
+                self.detail_fp.flush()
+        for name, n in counters:
+            console.log(f"{name}: {n}")
+        for name, buckets in histograms:
+            spread = ', '.join(
+                f"1e{bucket}: {n}" if bucket is not None else f"0: {n}"
+                for bucket, n in sorted(buckets.items(), key=lambda item: -1 if item[0] is None else item[0])
+            )
+            console.log(f"{name} by magnitude: {spread}")
+
+
+REPORTER = Reporter()
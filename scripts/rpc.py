@@ -0,0 +1,48 @@
+import threading
+
+import requests
+from brownie import web3
+
+
+class BatchRpc:
+    '''
+        sends JSON-RPC batch requests straight to the node's http endpoint
+    '''
+    def __init__(self, endpoint=None, timeout=120):
+        self._endpoint = endpoint
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def endpoint(self):
+        if self._endpoint is None:
+            return getattr(web3.provider, 'endpoint_uri', None)
+        return self._endpoint
+
+    @property
+    def session(self):
+        # requests sessions are not safe to share between worker threads
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, method, params_list):
+        '''
+            calls method once per params in a single batch, returning results in order
+        '''
+        payload = [
+            {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+            for i, params in enumerate(params_list)
+        ]
+        response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        replies = response.json()
+        if isinstance(replies, dict):
+            # some nodes answer a rejected batch with a single error object
+            raise ValueError(replies.get('error', replies))
+        results = [None] * len(payload)
+        for reply in replies:
+            if 'error' in reply:
+                raise ValueError(reply['error'])
+            results[reply['id']] = reply['result']
+        return results
@@ -1,6 +1,13 @@
 import json
-import statistics
+from bisect import bisect_right
+from heapq import merge
 from rich.console import Console
+from .reporting import REPORTER
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 console = Console()
 from brownie import *
@@ -19,80 +26,113 @@ Each user should get a minimum amount.
 
 
 def to_list(data):
-    list = []
-    for value in data.values():
-        list.append(value)
-    return list
+    return list(data.values())
 
 
-def get_stats(list):
+def get_stats(values, backend="sort", is_sorted=False):
+    """
+    "sort" sorts once (or not at all when is_sorted) and reads min, max and
+    median off the ordered values. "numpy" uses a float64 selection instead,
+    which is precise enough for the printed stats.
+    """
+    total = sum(values)
+    count = len(values)
+    half = count // 2
+    if backend == "numpy" and np is not None:
+        array = np.asarray(values, dtype=np.float64)
+        array.partition([half - 1, half] if count % 2 == 0 and count > 1 else half)
+        median = array[half] if count % 2 else (array[half - 1] + array[half]) / 2
+        highest, lowest = array.max(), array.min()
+    else:
+        ordered = values if is_sorted else sorted(values)
+        median = ordered[half] if count % 2 else (ordered[half - 1] + ordered[half]) / 2
+        highest, lowest = ordered[-1], ordered[0]
     return {
-        "total": sum(list),
-        "startTotal": sum(list),
-        "mean": statistics.mean(list),
-        "median": statistics.median(list),
-        "highest": max(list),
-        "lowest": min(list),
+        "total": total,
+        "startTotal": total,
+        "mean": total / count,
+        "median": median,
+        "highest": highest,
+        "lowest": lowest,
     }
 
 
-def smooth(data):
+def smooth(data, stats_backend="sort"):
     # f = open("snapshot/final.json",)
     # data = json.load(f)
 
     print("Processing values to list")
 
-    list = to_list(data)
+    keys = list(data.keys())
+    values = list(data.values())
 
     threshold = Wei("20 ether")
-    smoothed = data
+    threshold_to_smooth = threshold + Wei("5 ether")
+    use_sort = stats_backend != "numpy" or np is None
 
-    initial_stats = get_stats(list)
+    # raising to the threshold keeps the order, so this one sort serves every stats pass
+    ordered = sorted(values) if use_sort else None
+    initial_stats = get_stats(ordered, is_sorted=True) if use_sort else get_stats(values, stats_backend)
     startTotal = initial_stats["total"]
 
-    # Bring everyone below threshold to threshold
-    for key, value in smoothed.items():
+    # Bring everyone below threshold to threshold, summing what that adds and
+    # the value sitting above the smoothing threshold in the same pass
+    totalToRemove = 0
+    sum_above_20 = 0
+    for i, value in enumerate(values):
         if value <= threshold:
-            smoothed[key] = threshold
-            print("Bringing {} to threshold {}".format(value / 1e18, threshold / 1e18))
+            totalToRemove += threshold - value
+            values[i] = threshold
+            REPORTER.event("smooth.raised", value, address=keys[i], original=value, threshold=threshold)
+        elif value > threshold_to_smooth:
+            sum_above_20 += value
 
-    temp_list = to_list(smoothed)
-    temp_stats = get_stats(temp_list)
-    if_everyone_had_20 = len(list) * 20
+    if_everyone_had_20 = len(values) * 20
 
-    totalToRemove = sum(temp_list) - startTotal
+    def reduce(value):
+        # exact integer share of the excess, rounded so int(value - toRemove) matches
+        return value - (-(-totalToRemove * value // sum_above_20))
 
-    threshold_to_smooth = threshold + Wei("5 ether")
-
-    above_20 = []
-    for key, value in smoothed.items():
-        if value > threshold_to_smooth:
-            above_20.append(value)
-
-    sum_above_20 = sum(above_20)
+    if use_sort:
+        below = bisect_right(ordered, threshold)
+        above = bisect_right(ordered, threshold_to_smooth)
+        temp_stats = get_stats([threshold] * below + ordered[below:], is_sorted=True)
+    else:
+        temp_stats = get_stats(values, stats_backend)
 
     # Reduce every item above threshold proportionally
-    for key, value in smoothed.items():
+    for i, value in enumerate(values):
         if value > threshold_to_smooth:
-            proportionOfExcess = value / sum_above_20
-            toRemove = totalToRemove * proportionOfExcess
-            newValue = int(value - toRemove)
-            print(
-                "Removing {} ({}%) from value {} -> {}".format(
-                    toRemove / 1e18, proportionOfExcess, value / 1e18, newValue / 1e18,
-                )
+            newValue = reduce(value)
+            REPORTER.event(
+                "smooth.reduced", value - newValue, address=keys[i], original=value, new_value=newValue,
+                proportion=value / sum_above_20,
             )
-            smoothed[key] = newValue
+            values[i] = newValue
+
+    if use_sort:
+        # the reduction is monotonic, so the reduced tail stays sorted and one merge orders it all
+        reduced = list(map(reduce, ordered[above:]))
+        if totalToRemove > sum_above_20:
+            # removing more than the excess breaks monotonicity
+            reduced.sort()
+        end_list = list(merge([threshold] * below + ordered[below:above], reduced))
+        end_stats = get_stats(end_list, is_sorted=True)
+    else:
+        end_list = values
+        end_stats = get_stats(values, stats_backend)
+    temp_list = values
+
+    smoothed = data
+    smoothed.update(zip(keys, values))
 
-    end_list = to_list(smoothed)
-    end_sum = sum(end_list)
-    end_stats = get_stats(end_list)
     print(
         "Temp total is {}, Tokens To Remove: {}".format(
             temp_stats["total"], totalToRemove / 1e18
         )
     )
     print("There is {} value among tokens".format(sum_above_20 / 1e18))
+    REPORTER.summary("smooth.")
 
     # sum average mean median
     console.print("[bold cyan]===== Airdrop Stats =====[/bold cyan]")
@@ -103,7 +143,7 @@ def smooth(data):
     console.log(
         "min: ", initial_stats["lowest"] / 1e18, " (In Wei: )", initial_stats["lowest"]
     )
-    console.log("total recipients: ", len(list))
+    console.log("total recipients: ", len(values))
 
     console.log("if_everyone_had_20: ", if_everyone_had_20)
     console.log("total distributed: ", initial_stats["total"] / 1e18)
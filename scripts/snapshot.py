@@ -5,9 +5,19 @@ from tqdm import tqdm, trange
 from datetime import datetime
 import pytz
 import json
-from .utils import processCounter, SnapShotScraper, WriteJson, LoadJson, ContractLogParser
-from .utils import getMintersInfo, isContract, MerkleTree
-from .constants import ZERO_ADDRESS, SKIP_ADDRESSES, CURVE_ADAPTERS, INSTACCOUNT, ARGENT, ZAPPER, UNI_UNDECODABLE, ARGENT_UNISWAP, ZERION
+from .utils import processCounter, WriteJson, LoadJson, ContractLogParser
+from .utils import getMintersInfo, isContract, MerkleTree, joinLogsByTransaction
+from .transactions import TRANSACTIONS
+from .merkle import MerkleDistribution, writeDistribution
+from .claims import writeClaimsStore
+from .allocation import allocateSources
+from .reporting import REPORTER
+from .addresses import addressSet, excludeAddresses
+from .pipeline import Pipeline, Stage
+from .cache import cached
+from .hub import AsyncSnapShotScraper
+from .checkpoint import Checkpoint
+from .constants import ZERO_ADDRESS, AddressCategory, classify
 
 import os
 import math
@@ -28,34 +38,14 @@ import sys
 import csv
 
 DISTRIBUTOR_ADDRESS = '0x5e37996bcfF8C169e77b00D7b6e7261bbC60761e'
-
-
-
-def cached(path):
-    path = Path(path)
-    codec = {'.toml': toml, '.json': json}[path.suffix]
-    codec_args = {'.json': {'indent': 2}}.get(path.suffix, {})
-
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            if path.exists():
-                print('load from cache', path)
-                return codec.loads(path.read_text())
-            else:
-                result = func(*args, **kwargs)
-                os.makedirs(path.parent, exist_ok=True)
-                path.write_text(codec.dumps(result, **codec_args))
-                print('write to cache', path)
-                return result
-
-        return wrapper
-
-    return decorator
+MERKLE_DISTRIBUTION_FILE = 'snapshot/08-merkle-distribution.json'
+MERKLE_CLAIMS_STORE = 'snapshot/08-merkle-claims.bin'
+MERKLE_TREE_DIR = './cache/merkle-tree'
+MERKLE_DIFF_FILE = 'snapshot/08-merkle-diff.json'
 
 
 def get_yearn_governance(out_file_name=None):
-    YFI = SnapShotScraper(
+    YFI = AsyncSnapShotScraper(
         key = 'yearn',
         cutoff = datetime(2020, 11, 13, tzinfo=pytz.UTC),
         debug=False
@@ -73,22 +63,29 @@ def get_ygov_and_snapshot_participants(out_file_name=None):
     START_BLOCK= 10553531 
     SNAPSHOT_BLOCK = 11245937  # Nov-13-2020 12:00:12 AM +UTC
     ygovAddress = '0xBa37B002AbaFDd8E89a1995dA52740bbC013D992'
-    ygovABI = LoadJson(f"./interfaces/Yearn.json")
-    yearn = web3.eth.contract(ygovAddress, abi=ygovABI)
-    for start in trange(START_BLOCK, SNAPSHOT_BLOCK, 1000):
-        end = min(start + 999, SNAPSHOT_BLOCK)
-        logs = yearn.events.NewProposal().getLogs(fromBlock=start, toBlock=end)
-        for log in logs:
-            users[log.args.creator] = 1
-
-        logs = yearn.events.Staked().getLogs(fromBlock=start, toBlock=end)
-        for log in logs:
-            # users[log.args.user] = log.args.amount
-            users[log.args.user] = 1
-
-        logs = yearn.events.Vote().getLogs(fromBlock=start, toBlock=end)
-        for log in logs:
-            users[log.args.voter] = 1
+    yearn = ContractLogParser(
+                            startBlock=START_BLOCK,
+                            endBlock=SNAPSHOT_BLOCK,
+                            address=ygovAddress,
+                            abi_fn="./interfaces/Yearn.json",
+                            event_name=['NewProposal', 'Staked', 'Vote'],
+                            )
+
+    def on_new_proposal(log):
+        users[log.args.creator] = 1
+
+    def on_staked(log):
+        # users[log.args.user] = log.args.amount
+        users[log.args.user] = 1
+
+    def on_vote(log):
+        users[log.args.voter] = 1
+
+    yearn.dispatch({
+        'NewProposal': on_new_proposal,
+        'Staked': on_staked,
+        'Vote': on_vote,
+    })
 
     result = processCounter(users)
     if out_file_name != None:
@@ -96,17 +93,13 @@ def get_ygov_and_snapshot_participants(out_file_name=None):
     return result 
 
 def cleanupSnapshot(new_snapshot, old_fn):
-    old_snapshot = LoadJson(old_fn)
-    count = 0
-    for key in old_snapshot.keys(): 
-        if key in new_snapshot.keys():
-            count += 1
-            del new_snapshot[key]  
-        checksumed_key = web3.toChecksumAddress(key)  
-        if checksumed_key in new_snapshot.keys():
-            count += 1
-            del new_snapshot[key]          
-    print(f"deleted {count} addresses using {old_fn}")
+    # compare on 20 byte addresses so checksum and lowercase keys match each other
+    old_addresses = addressSet(LoadJson(old_fn).keys())
+    new_snapshot, removed = excludeAddresses(new_snapshot, old_addresses)
+    for key in removed:
+        REPORTER.detail('cleanup.deleted', address=key, source=old_fn)
+    REPORTER.count('cleanup.deleted', len(removed))
+    print(f"deleted {len(removed)} addresses using {old_fn}")
     return new_snapshot
 
 def get_renbtc_mint(out_file_name=None):
@@ -123,24 +116,41 @@ def get_renbtc_mint(out_file_name=None):
                             abi_fn="./interfaces/Gateway.json",
                             event_name='LogMint',
                             )
-    for log in renBTC.get_logs():
-        # contract address that interacted with btcgateway
-        contract_address = log['args']['_to']
-        # skip the addresses that we can't decode 
-        if contract_address in SKIP_ADDRESSES: continue
-        # get transaction of the event to read the input data
-        tx = web3.eth.getTransaction(log.transactionHash.hex())
+    checkpoint = Checkpoint('renbtc_mint', get_renbtc_mint, START_BLOCK, SNAPSHOT_BLOCK)
+    resume_block, mints = checkpoint.load(mints)
+
+    def pending_mints():
+        for log in renBTC.get_logs(startBlock=resume_block):
+            # contract address that interacted with btcgateway
+            contract_address = log['args']['_to']
+            # skip the addresses that we can't decode 
+            if classify(contract_address) & AddressCategory.SKIP:
+                REPORTER.count('renbtc_mint.skipped')
+                continue
+            # get transaction of the event to read the input data
+            yield log.transactionHash, log
+
+    for log, tx in TRANSACTIONS.resolve(pending_mints()):
+        checkpoint.advance(log.blockNumber, mints)
         # checking skip addresses again, because sometimes log['args']['_to'] != tx.to
-        if tx.to in SKIP_ADDRESSES: continue            
+        if classify(tx.to) & AddressCategory.SKIP:
+            REPORTER.count('renbtc_mint.skipped')
+            continue
         # parse the user_address and amount
         result = getMintersInfo(tx)
-        if result is None: continue
+        if result is None:
+            REPORTER.event('renbtc_mint.undecoded', tx=tx.hash.hex(), to=tx.to)
+            continue
         user_address, amount = result
+        REPORTER.observe('renbtc_mint.amount', amount)
         mints[user_address] += amount
 
+    TRANSACTIONS.report()
+    REPORTER.summary('renbtc_mint.')
     result = processCounter(mints)   
     if out_file_name != None:
         WriteJson(out_file_name, result)
+    checkpoint.complete()
     return result    
 
 
@@ -156,34 +166,55 @@ def get_sbtc_lps(out_file_name=None):
                             abi_fn="./interfaces/CurveLP.json",
                             event_name='Transfer',
                             )  
-    for log in SBTCLP.get_logs():                              
+    checkpoint = Checkpoint('sbtc_lp', get_sbtc_lps, STARTBLOCK, SNAPSHOT_BLOCK)
+    resume_block, lps = checkpoint.load(lps)
+
+    def pending_transfers():
+        for log in SBTCLP.get_logs(startBlock=resume_block):
+            receiver = log.args._to
+            category = classify(receiver)
+            if category & AddressCategory.SKIP:
+                REPORTER.count('sbtc_lp.skipped')
+                continue
+            elif category & (AddressCategory.CURVE_WALLET | AddressCategory.ZAPPER):
+                yield log.transactionHash, log
+            else:
+                yield None, log
+
+    for log, tx in TRANSACTIONS.resolve(pending_transfers()):
+        checkpoint.advance(log.blockNumber, lps)
         sender = log.args._from
         receiver = log.args._to
         amount = log.args._value
-        txid = log.transactionHash.hex()
-        if receiver in SKIP_ADDRESSES: continue
-        elif (receiver in CURVE_ADAPTERS) or (receiver in INSTACCOUNT) or (receiver in ARGENT):
-            tx = web3.eth.getTransaction(txid)
+        category = classify(receiver)
+        if not category & (AddressCategory.CURVE_WALLET | AddressCategory.ZAPPER):
+            # plain holders, pending_transfers did not ask for their transaction
+            lps[receiver] += amount
+        elif category & AddressCategory.CURVE_WALLET:
             result = getMintersInfo(tx)
-            if result is None: continue
+            if result is None:
+                REPORTER.event('sbtc_lp.undecoded', tx=tx.hash.hex(), receiver=receiver)
+                continue
             user_address, _ = result
             lps[user_address] += amount
-        elif receiver in ZAPPER:
-            tx = web3.eth.getTransaction(txid)
+        else:
             result = getMintersInfo(tx)
-            if result is None: continue
+            if result is None:
+                REPORTER.event('sbtc_lp.undecoded', tx=tx.hash.hex(), receiver=receiver)
+                continue
             try:
                 user_address, amount = result
                 lps[user_address] += amount 
             except Exception as e:
-                pass 
-        else:
-            lps[receiver] += amount
+                REPORTER.event('sbtc_lp.zapper_error', tx=tx.hash.hex(), error=e)
 
+    TRANSACTIONS.report()
+    REPORTER.summary('sbtc_lp.')
     result = processCounter(lps)
     print(len(result))   
     if out_file_name != None:
         WriteJson(out_file_name, result)
+    checkpoint.complete()
     return result     
 
 
@@ -199,34 +230,55 @@ def get_renbtc_lps(out_file_name=None):
                             abi_fn="./interfaces/CurveLP.json",
                             event_name='Transfer',
                             )  
-    for log in renBTCLP.get_logs():                              
+    checkpoint = Checkpoint('renbtc_lp', get_renbtc_lps, STARTBLOCK, SNAPSHOT_BLOCK)
+    resume_block, lps = checkpoint.load(lps)
+
+    def pending_transfers():
+        for log in renBTCLP.get_logs(startBlock=resume_block):
+            receiver = log.args._to
+            category = classify(receiver)
+            if category & AddressCategory.SKIP:
+                REPORTER.count('renbtc_lp.skipped')
+                continue
+            elif category & (AddressCategory.CURVE_WALLET | AddressCategory.ZAPPER):
+                yield log.transactionHash, log
+            else:
+                yield None, log
+
+    for log, tx in TRANSACTIONS.resolve(pending_transfers()):
+        checkpoint.advance(log.blockNumber, lps)
         sender = log.args._from
         receiver = log.args._to
         amount = log.args._value
-        txid = log.transactionHash.hex()
-        if receiver in SKIP_ADDRESSES: continue
-        elif (receiver in CURVE_ADAPTERS) or (receiver in INSTACCOUNT) or (receiver in ARGENT):
-            tx = web3.eth.getTransaction(txid)
+        category = classify(receiver)
+        if not category & (AddressCategory.CURVE_WALLET | AddressCategory.ZAPPER):
+            # plain holders, pending_transfers did not ask for their transaction
+            lps[receiver] += amount
+        elif category & AddressCategory.CURVE_WALLET:
             result = getMintersInfo(tx)
-            if result is None: continue
+            if result is None:
+                REPORTER.event('renbtc_lp.undecoded', tx=tx.hash.hex(), receiver=receiver)
+                continue
             user_address, _ = result
             lps[user_address] += amount
-        elif receiver in ZAPPER:
-            tx = web3.eth.getTransaction(txid)
+        else:
             result = getMintersInfo(tx)
-            if result is None: continue
+            if result is None:
+                REPORTER.event('renbtc_lp.undecoded', tx=tx.hash.hex(), receiver=receiver)
+                continue
             try:
                 user_address, amount = result
                 lps[user_address] += amount 
             except Exception as e:
-                pass 
-        else:
-            lps[receiver] += amount
+                REPORTER.event('renbtc_lp.zapper_error', tx=tx.hash.hex(), error=e)
 
+    TRANSACTIONS.report()
+    REPORTER.summary('renbtc_lp.')
     result = processCounter(lps)
     print(len(result))   
     if out_file_name != None:
         WriteJson(out_file_name, result)
+    checkpoint.complete()
     return result     
 
 
@@ -236,60 +288,93 @@ def get_uniswap_lps(out_file_name=None):
     UNISWAP_WBTC_ETH_LP_ADDRESS = '0xBb2b8038a1640196FbE3e38816F3e67Cba72D940'
     WBTC_ADDRESS = '0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599'
     
-    uniWBTCETHABI = LoadJson(f"./interfaces/UniswapPair.json")
-    ERC20_ABI = LoadJson(f"./interfaces/ERC20.json")
     START_BLOCK = 9737055
     UNISWAP_SNAPSHOT_BLOCK = 11304643 #Nov-22-2020 12:00:00 AM +UTC
 
-    uniswap = web3.eth.contract(UNISWAP_WBTC_ETH_LP_ADDRESS, abi=uniWBTCETHABI)
-    wbtc = web3.eth.contract(WBTC_ADDRESS, abi=ERC20_ABI)
-
-    for start in trange(START_BLOCK, UNISWAP_SNAPSHOT_BLOCK, 1000):
-        end = min(start + 999, UNISWAP_SNAPSHOT_BLOCK)
-        logs = uniswap.events.Transfer().getLogs(fromBlock=start, toBlock=end,argument_filters={"from": ZERO_ADDRESS})
-        wbtc_logs = wbtc.events.Transfer().getLogs(fromBlock=start, toBlock=end,argument_filters={"dst": UNISWAP_WBTC_ETH_LP_ADDRESS})
-        for log in logs:
-            if log['args']['from'] == ZERO_ADDRESS:
-                lp_provider = log.args.to
-                mint_txid = log.transactionHash
-                if lp_provider in UNI_UNDECODABLE: continue 
-                want_log = next(
-                                filter( lambda tx: (tx.transactionHash == mint_txid) and\
-                                                    (tx.args.dst == UNISWAP_WBTC_ETH_LP_ADDRESS), wbtc_logs))
-
-                if (lp_provider in ARGENT_UNISWAP) or (lp_provider in ZAPPER):
-                    tx = web3.eth.getTransaction(mint_txid)
-                    result = getMintersInfo(tx)
-                    if result is None: continue
-                    user_address, _ = result
-                    suppliers[user_address] += want_log.args.wad
-                elif lp_provider in ZERION:
-                    tx = web3.eth.getTransaction(mint_txid)
-                    suppliers[tx["from"]] += want_log.args.wad
-                else:               
-                    suppliers[lp_provider] += want_log.args.wad
-
+    uniswap = ContractLogParser(
+                            startBlock=START_BLOCK,
+                            endBlock=UNISWAP_SNAPSHOT_BLOCK,
+                            address=UNISWAP_WBTC_ETH_LP_ADDRESS,
+                            abi_fn="./interfaces/UniswapPair.json",
+                            event_name='Transfer',
+                            )
+    wbtc = ContractLogParser(
+                            startBlock=START_BLOCK,
+                            endBlock=UNISWAP_SNAPSHOT_BLOCK,
+                            address=WBTC_ADDRESS,
+                            abi_fn="./interfaces/ERC20.json",
+                            event_name='Transfer',
+                            )
+    checkpoint = Checkpoint('uniswap', get_uniswap_lps, START_BLOCK, UNISWAP_SNAPSHOT_BLOCK)
+    resume_block, suppliers = checkpoint.load(suppliers)
+    mint_logs = uniswap.get_logs(argument_filters={"from": ZERO_ADDRESS}, startBlock=resume_block)
+    wbtc_logs = wbtc.get_logs(argument_filters={"dst": UNISWAP_WBTC_ETH_LP_ADDRESS}, startBlock=resume_block)
+
+    def pending_mints():
+        for log, transfers in joinLogsByTransaction(mint_logs, wbtc_logs):
+            lp_provider = log.args.to
+            mint_txid = log.transactionHash
+            if lp_provider == ZERO_ADDRESS:
+                # the pair's first mint locks MINIMUM_LIQUIDITY at 0x0 ahead of the provider's
+                # mint in the same tx, it must not take the provider's wbtc transfer
+                REPORTER.count('uniswap.minimum_liquidity')
+                continue
+            category = classify(lp_provider)
+            if category & AddressCategory.UNI_UNDECODABLE:
+                REPORTER.count('uniswap.skipped')
+                continue
+            # the wbtc deposit that funds a mint happens earlier in the same tx,
+            # pair each mint with the closest one it has not been paired with yet
+            preceding = [transfer for transfer in transfers if transfer.logIndex < log.logIndex]
+            if not preceding:
+                REPORTER.event('uniswap.missing_wbtc_transfer', tx=mint_txid.hex(), provider=lp_provider)
+                continue
+            if len(transfers) > 1:
+                REPORTER.event('uniswap.several_wbtc_transfers', tx=mint_txid.hex(), provider=lp_provider)
+            want_log = preceding[-1]
+            transfers.remove(want_log)
+            needs_tx = bool(category & (AddressCategory.UNISWAP_WALLET | AddressCategory.ZERION))
+            yield (mint_txid if needs_tx else None), (lp_provider, want_log)
+
+    for (lp_provider, want_log), tx in TRANSACTIONS.resolve(pending_mints()):
+        # the wbtc deposit is in the same transaction, so in the same block as the mint
+        checkpoint.advance(want_log.blockNumber, suppliers)
+        category = classify(lp_provider)
+        if category & AddressCategory.UNISWAP_WALLET:
+            result = getMintersInfo(tx)
+            if result is None:
+                REPORTER.event('uniswap.undecoded', tx=tx.hash.hex(), provider=lp_provider)
+                continue
+            user_address, _ = result
+            suppliers[user_address] += want_log.args.wad
+        elif category & AddressCategory.ZERION:
+            suppliers[tx["from"]] += want_log.args.wad
+        else:               
+            suppliers[lp_provider] += want_log.args.wad
+
+    TRANSACTIONS.report()
+    REPORTER.summary('uniswap.')
     result = processCounter(suppliers)
     if out_file_name != None:
         WriteJson(out_file_name, result)
+    checkpoint.complete()
     return result     
 
 
-@cached('snapshot/08-merkle-distribution.json')
-def step_07(balances):
-    elements = [(index, account, amount) for index, (account, amount) in enumerate(balances.items())]
-    nodes = [encode_hex(encode_abi_packed(['uint', 'address', 'uint'], el)) for el in elements]
-    tree = MerkleTree(nodes)
-    distribution = {
-        'merkleRoot': encode_hex(tree.root),
-        'tokenTotal': hex(sum(balances.values())),
-        'claims': {
-            user: {'index': index, 'amount': hex(amount), 'proof': tree.get_proof(nodes[index])}
-            for index, user, amount in elements
-        },
-    }
-    print(f'merkle root: {encode_hex(tree.root)}')
-    return distribution
+@cached(codec='json', outputs=(MERKLE_DISTRIBUTION_FILE, MERKLE_CLAIMS_STORE, MERKLE_TREE_DIR))
+def step_07(balances, indent=2, shard_size=None):
+    # reuses the tree saved by the previous run when the claims are unchanged
+    tree, diff = MerkleDistribution.open(MERKLE_TREE_DIR, balances, processes=os.cpu_count())
+    if diff is not None:
+        WriteJson(MERKLE_DIFF_FILE, diff)
+        print(f"{len(diff['changed'])} claims changed, {len(diff['added'])} added, {len(diff['removed'])} removed")
+    # claims are streamed to disk as their proofs are generated, never held as one dict
+    summary = writeDistribution(MERKLE_DISTRIBUTION_FILE, tree, indent=indent, shard_size=shard_size)
+    # address indexed copy for per-address proof lookups without parsing the json
+    writeClaimsStore(MERKLE_CLAIMS_STORE, tree)
+    print(f"merkle root: {summary['merkleRoot']}")
+    print('write to', MERKLE_DISTRIBUTION_FILE)
+    return summary
 
 
 def deploy():
@@ -307,152 +392,84 @@ def writeCsv(out_file_name, items):
         for addr, amount in items:
             csv_writer.writerow([addr, amount])
 
-def main():
+def exportCsv(snapshot, out_file_name):
+    writeCsv(out_file_name, snapshot.items())
+    return snapshot
 
-    print("#5 - yearn snapshot and ygov Governance")
-    # yearn = get_ygov_and_snapshot_participants(out_file_name="./snapshot/yearn.json") 
-    # yearn = LoadJson("./snapshot/yearn.json")   
-    # writeCsv("./snapshot/yearn.csv", yearn.items()) 
 
-    print("#8 - Minted renBTC")
-    # renbtc_mints = get_renbtc_mint(out_file_name="./snapshot/renbtc_mint.json")    
-    # renbtc_mints = cleanupSnapshot(renbtc_mints, './old_snapshot/renbtcMinters.json')
-    # old_renbtc_mints = LoadJson("./old_snapshot/renbtcMinters.json")
-    # writeCsv("./snapshot/old_renbtc_mint.csv", old_renbtc_mints.items())
-    # fix dupilcates error
-    renbtc_mints = LoadJson("./snapshot/renbtc_mint.json")
-    renbtc_mints = cleanupSnapshot(renbtc_mints, './old_snapshot/renbtcMinters.json')
-    writeCsv("./snapshot/renbtc_mint.csv", renbtc_mints.items())
-
-    print("#10 - Curve SBTC LPs")
-    # curve_sbtc_lp = get_sbtc_lps(out_file_name="./snapshot/curve_sbtclp.json")
-    # curve_sbtc_lp = cleanupSnapshot(curve_sbtc_lp, './old_snapshot/sbtcLP.json')
-    # curve_sbtc_lp = LoadJson("./old_snapshot/sbtcLP.json")
-    # writeCsv("./snapshot/old_curve_sbtclp.csv", curve_sbtc_lp.items())
+def cleanupAndExport(snapshot, old_fn, out_file_name):
     # fix dupilcates error
-    curve_sbtc_lp = LoadJson("./snapshot/curve_sbtclp.json")
-    curve_sbtc_lp = cleanupSnapshot(curve_sbtc_lp, './old_snapshot/sbtcLP.json')
-    writeCsv("./snapshot/curve_sbtclp.csv", curve_sbtc_lp.items())
-
-    print("#10 - Curve renBTC  LPs")
-    # curve_renbtc_lp = get_renbtc_lps(out_file_name="./snapshot/curve_renbtclp.json")    
-    # curve_renbtc_lp = cleanupSnapshot(curve_renbtc_lp, './old_snapshot/renbtcLP.json')
-    # curve_renbtc_lp = LoadJson("./old_snapshot/renbtcLP.json")
-    # writeCsv("./snapshot/old_curve_renbtclp.csv", curve_renbtc_lp.items())
-    # fix dupilcates error
-    curve_renbtc_lp = LoadJson("./snapshot/curve_renbtclp.json")
-    curve_renbtc_lp = cleanupSnapshot(curve_renbtc_lp, './old_snapshot/renbtcLP.json')
-    writeCsv("./snapshot/curve_renbtclp.csv", curve_renbtc_lp.items())
-
-    print("#16 - Provided wBTC/ETH liquidity on Uniswap ")
-    # uniswap = get_uniswap_lps(out_file_name="./snapshot/uniswap.json")
-    # uniswap = cleanupSnapshot(uniswap, './old_snapshot/uniLP.json')
-    # uniswap = LoadJson("./old_snapshot/uniLP.json")
-    # writeCsv("./snapshot/old_uniswap.csv", uniswap.items())
-    # fix dupilcates error
-    uniswap = LoadJson("./snapshot/uniswap.json")
-    uniswap = cleanupSnapshot(uniswap, './old_snapshot/uniLP.json')
-    writeCsv("./snapshot/uniswap.csv", uniswap.items())
-
-    print("exiting early")
-    sys.exit(0)
-
-    AIRDROP_AMOUNT = 12574850300000000000000
-    final = Counter()
-    grandTotal = 0
-    total = 0
-    check = 0
-    #yearn = LoadJson("./snapshot/yearn.json")
-
-    for key in yearn:
-        total += yearn[key]
-
-    for key in yearn:    
-        yearn[key] =  Wei((yearn[key]/total)*AIRDROP_AMOUNT)
-        check += yearn[key]
-        final[web3.toChecksumAddress(key)] += yearn[key]
-    
-    print("yearn Governance:", Wei(check).to("ether"))
-
-    AIRDROP_AMOUNT = 12574850300000000000000
-    grandTotal += check
-    total = 0
-    check = 0
-    #renbtc_mints = LoadJson("./snapshot/renbtc_mint.json")
-    #renbtc_mints = cleanupSnapshot(renbtc_mints, './old_snapshot/renbtcMinters.json')
-    #
-    for key in renbtc_mints:
-        total += renbtc_mints[key]
-
-    for key in renbtc_mints:    
-        renbtc_mints[key] =  Wei((renbtc_mints[key]/total)*AIRDROP_AMOUNT)
-        check += renbtc_mints[key]
-        final[web3.toChecksumAddress(key)] += renbtc_mints[key]
-    
-    print("Minted renBTC:", Wei(check).to("ether"))
-
-
-    AIRDROP_AMOUNT = 12574850300000000000000
-    grandTotal += check
-    total = 0
-    check = 0
-    #curve_sbtc_lp = LoadJson("./snapshot/curve_sbtclp.json")
-    #curve_sbtc_lp = cleanupSnapshot(curve_sbtc_lp, './old_snapshot/sbtcLP.json')
-    #
-    for key in curve_sbtc_lp:
-        total += curve_sbtc_lp[key]
-
-    for key in curve_sbtc_lp:    
-        curve_sbtc_lp[key] =  Wei((curve_sbtc_lp[key]/total)*AIRDROP_AMOUNT)
-        check += curve_sbtc_lp[key]
-        final[web3.toChecksumAddress(key)] += curve_sbtc_lp[key]
-    
-    print("Curve SBTC LPs:", Wei(check).to("ether"))    
-
-
-    AIRDROP_AMOUNT = 12574850300000000000000
-    grandTotal += check
-    total = 0
-    check = 0
-    #curve_renbtc_lp = LoadJson("./snapshot/curve_renbtclp.json")
-    #curve_renbtc_lp = cleanupSnapshot(curve_renbtc_lp, './old_snapshot/renbtcLP.json')
-    #
-    for key in curve_renbtc_lp:
-        total += curve_renbtc_lp[key]
-
-    for key in curve_renbtc_lp:    
-        curve_renbtc_lp[key] =  Wei((curve_renbtc_lp[key]/total)*AIRDROP_AMOUNT)
-        check += curve_renbtc_lp[key]
-        final[web3.toChecksumAddress(key)] += curve_renbtc_lp[key]
-    
-    print("Curve renBTC  LPs:", Wei(check).to("ether"))    
+    snapshot = cleanupSnapshot(snapshot, old_fn)
+    writeCsv(out_file_name, snapshot.items())
+    return snapshot
 
 
+def allocateAirdrop(yearn, renbtc_mints, curve_sbtc_lp, curve_renbtc_lp, uniswap):
     AIRDROP_AMOUNT = 12574850300000000000000
-    grandTotal += check
-    total = 0
-    check = 0
-    #uniswap = LoadJson("./snapshot/uniswap.json")
-    #uniswap = cleanupSnapshot(uniswap, './old_snapshot/uniLP.json')
-    #
-    for key in uniswap:
-        total += uniswap[key]
-
-    for key in uniswap:    
-        uniswap[key] =  Wei((uniswap[key]/total)*AIRDROP_AMOUNT)
-        check += uniswap[key]
-        final[web3.toChecksumAddress(key)] += uniswap[key]
-    
-    print("Provided wBTC/ETH liquidity on Uniswap:", Wei(check).to("ether"))      
-
-    grandTotal += check
-
+    final, grandTotal = allocateSources([
+        ("yearn Governance", yearn, AIRDROP_AMOUNT),
+        ("Minted renBTC", renbtc_mints, AIRDROP_AMOUNT),
+        ("Curve SBTC LPs", curve_sbtc_lp, AIRDROP_AMOUNT),
+        ("Curve renBTC  LPs", curve_renbtc_lp, AIRDROP_AMOUNT),
+        ("Provided wBTC/ETH liquidity on Uniswap", uniswap, AIRDROP_AMOUNT),
+    ])
 
     print("Total:", Wei(grandTotal).to("ether"))
     print("Missing:", Wei(2100000000000000000000000-grandTotal).to("ether"))
+    return final
+
 
+def smoothAndSave(final):
     final = smooth(final)    
 
     with open('./snapshot/final.json', 'w') as fp:
         json.dump(final, fp)
-    step_07(final)    
\ No newline at end of file
+    return final
+
+
+# scrapes reload their json instead of hitting the node again until their code changes
+SNAPSHOT_STAGES = [
+    # 5 - yearn snapshot and ygov Governance
+    Stage('yearn', get_ygov_and_snapshot_participants, args=("./snapshot/yearn.json",),
+          outputs=("./snapshot/yearn.json",), load=partial(LoadJson, "./snapshot/yearn.json")),
+    Stage('yearn_csv', exportCsv, args=("./snapshot/yearn.csv",), deps=('yearn',)),
+    # 8 - Minted renBTC
+    Stage('renbtc_mint', get_renbtc_mint, args=("./snapshot/renbtc_mint.json",),
+          outputs=("./snapshot/renbtc_mint.json",), load=partial(LoadJson, "./snapshot/renbtc_mint.json")),
+    Stage('renbtc_mint_csv', cleanupAndExport, args=('./old_snapshot/renbtcMinters.json', "./snapshot/renbtc_mint.csv"),
+          deps=('renbtc_mint',), inputs=('./old_snapshot/renbtcMinters.json',)),
+    # 10 - Curve SBTC LPs
+    Stage('curve_sbtc_lp', get_sbtc_lps, args=("./snapshot/curve_sbtclp.json",),
+          outputs=("./snapshot/curve_sbtclp.json",), load=partial(LoadJson, "./snapshot/curve_sbtclp.json")),
+    Stage('curve_sbtc_lp_csv', cleanupAndExport, args=('./old_snapshot/sbtcLP.json', "./snapshot/curve_sbtclp.csv"),
+          deps=('curve_sbtc_lp',), inputs=('./old_snapshot/sbtcLP.json',)),
+    # 10 - Curve renBTC  LPs
+    Stage('curve_renbtc_lp', get_renbtc_lps, args=("./snapshot/curve_renbtclp.json",),
+          outputs=("./snapshot/curve_renbtclp.json",), load=partial(LoadJson, "./snapshot/curve_renbtclp.json")),
+    Stage('curve_renbtc_lp_csv', cleanupAndExport, args=('./old_snapshot/renbtcLP.json', "./snapshot/curve_renbtclp.csv"),
+          deps=('curve_renbtc_lp',), inputs=('./old_snapshot/renbtcLP.json',)),
+    # 16 - Provided wBTC/ETH liquidity on Uniswap
+    Stage('uniswap', get_uniswap_lps, args=("./snapshot/uniswap.json",),
+          outputs=("./snapshot/uniswap.json",), load=partial(LoadJson, "./snapshot/uniswap.json")),
+    Stage('uniswap_csv', cleanupAndExport, args=('./old_snapshot/uniLP.json', "./snapshot/uniswap.csv"),
+          deps=('uniswap',), inputs=('./old_snapshot/uniLP.json',)),
+    Stage('allocation', allocateAirdrop,
+          deps=('yearn_csv', 'renbtc_mint_csv', 'curve_sbtc_lp_csv', 'curve_renbtc_lp_csv', 'uniswap_csv')),
+    Stage('smoothing', smoothAndSave, deps=('allocation',),
+          outputs=('./snapshot/final.json',), load=partial(LoadJson, './snapshot/final.json')),
+    Stage('merkle', step_07, deps=('smoothing',)),
+]
+
+EXPORT_STAGES = ('yearn_csv', 'renbtc_mint_csv', 'curve_sbtc_lp_csv', 'curve_renbtc_lp_csv', 'uniswap_csv')
+
+
+def main(full=False):
+    '''
+        brownie run snapshot --network archive                  # scrapes and csv exports
+        brownie run snapshot main True --network archive        # through allocation, smoothing and merkle
+    '''
+    # brownie run passes script arguments as strings
+    full = str(full).lower() in ('1', 'true')
+    REPORTER.configure(detail_path='./cache/details.jsonl', sample_every=1)
+    pipeline = Pipeline(SNAPSHOT_STAGES)
+    pipeline.run(targets=None if full else EXPORT_STAGES)
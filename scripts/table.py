@@ -0,0 +1,147 @@
+import json
+import mmap
+import struct
+from pathlib import Path
+
+from .addresses import canonicalize, toAddressBytes, toChecksum
+
+
+'''
+Balance table layout, all integers big endian:
+    magic        8 bytes  b'BALTBL01'
+    count        uint64
+    addresses    count * 20 bytes, sorted
+    amounts      count * 32 bytes, two's complement int256 in the same order
+                 (uint256 range for every real balance, signed so historical
+                 snapshots with negative entries still round trip)
+'''
+
+TABLE_MAGIC = b'BALTBL01'
+HEADER = struct.Struct('>8sQ')
+ADDRESS_SIZE = 20
+AMOUNT_SIZE = 32
+
+
+def searchSorted(buffer, offset, count, width, key):
+    '''
+        binary search for key in count sorted fixed width records starting at offset,
+        returns its position or -1
+    '''
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = offset + mid * width
+        value = buffer[start:start + len(key)]
+        if value < key:
+            lo = mid + 1
+        elif value > key:
+            hi = mid
+        else:
+            return mid
+    return -1
+
+
+def writeTable(fn, data):
+    '''
+        writes an address -> amount mapping as a sorted balance table
+    '''
+    rows = sorted(canonicalize(data).items())
+    with open(fn, 'wb') as fp:
+        fp.write(HEADER.pack(TABLE_MAGIC, len(rows)))
+        for address, _ in rows:
+            fp.write(address)
+        for _, amount in rows:
+            fp.write(amount.to_bytes(AMOUNT_SIZE, 'big', signed=True))
+
+
+class BalanceTable:
+    '''
+        read only, memory mapped view of a balance table with O(log n) lookups
+    '''
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, 'rb') as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.buffer, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError(f"{fn} is not a balance table")
+        self.addresses_offset = HEADER.size
+        self.amounts_offset = self.addresses_offset + self.count * ADDRESS_SIZE
+        if len(self.buffer) != self.amounts_offset + self.count * AMOUNT_SIZE:
+            raise ValueError(f"{fn} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def position(self, address):
+        return searchSorted(self.buffer, self.addresses_offset, self.count, ADDRESS_SIZE, toAddressBytes(address))
+
+    def __contains__(self, address):
+        return self.position(address) >= 0
+
+    def amount_at(self, position):
+        start = self.amounts_offset + position * AMOUNT_SIZE
+        return int.from_bytes(self.buffer[start:start + AMOUNT_SIZE], 'big', signed=True)
+
+    def address_at(self, position):
+        start = self.addresses_offset + position * ADDRESS_SIZE
+        return self.buffer[start:start + ADDRESS_SIZE]
+
+    def get(self, address, default=None):
+        position = self.position(address)
+        return self.amount_at(position) if position >= 0 else default
+
+    def __getitem__(self, address):
+        position = self.position(address)
+        if position < 0:
+            raise KeyError(address)
+        return self.amount_at(position)
+
+    def keys(self):
+        return (toChecksum(self.address_at(i)) for i in range(self.count))
+
+    def items(self):
+        return ((toChecksum(self.address_at(i)), self.amount_at(i)) for i in range(self.count))
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convertJsonToTable(json_fn, table_fn=None):
+    '''
+        converts an address -> amount json snapshot, writing next to it with a .tbl suffix
+    '''
+    table_fn = table_fn or Path(json_fn).with_suffix('.tbl')
+    with open(json_fn) as fp:
+        writeTable(table_fn, json.load(fp))
+    return table_fn
+
+
+def convertSnapshots(directories=('./snapshot', './old_snapshot')):
+    '''
+        converts every address -> amount json in directories, skipping other json files
+    '''
+    converted = []
+    for directory in directories:
+        for json_fn in sorted(Path(directory).glob('*.json')):
+            with open(json_fn) as fp:
+                data = json.load(fp)
+            if not isinstance(data, dict) or not all(isinstance(v, int) for v in data.values()):
+                continue
+            try:
+                table_fn = json_fn.with_suffix('.tbl')
+                writeTable(table_fn, data)
+            except ValueError:
+                # keys that are not addresses
+                continue
+            converted.append(table_fn)
+    return converted
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from brownie import web3
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.exceptions import TransactionNotFound
+
+from .cache import TransactionCache, TX_CACHE_PATH
+from .rpc import BatchRpc
+
+
+def txKey(txid):
+    '''
+        normalizes a tx hash given as hex string or bytes to lowercase 0x-hex
+    '''
+    return '0x' + bytes(HexBytes(txid)).hex()
+
+
+def formatTransaction(raw):
+    '''
+        keeps the fields the scrapers read, in the shape web3.eth.getTransaction returns
+    '''
+    return AttributeDict({
+        'hash': HexBytes(raw['hash']),
+        'from': to_checksum_address(raw['from']),
+        'to': to_checksum_address(raw['to']) if raw['to'] else None,
+        'input': raw['input'] if isinstance(raw['input'], str) else '0x' + bytes(raw['input']).hex(),
+    })
+
+
+def packTransaction(tx):
+    '''
+        (hash, from, to, input) as raw bytes for the transaction cache
+    '''
+    return (
+        bytes(tx['hash']),
+        bytes(HexBytes(tx['from'])),
+        bytes(HexBytes(tx['to'])) if tx['to'] else None,
+        bytes(HexBytes(tx['input'])),
+    )
+
+
+def unpackTransaction(tx_hash, sender, receiver, data):
+    return formatTransaction({
+        'hash': bytes(tx_hash),
+        'from': '0x' + bytes(sender).hex(),
+        'to': '0x' + bytes(receiver).hex() if receiver else None,
+        'input': bytes(data),
+    })
+
+
+class TransactionFetcher:
+    '''
+        resolves transactions by hash with batched eth_getTransactionByHash calls,
+        running several batches concurrently
+    '''
+    def __init__(self, batch_size=100, max_workers=4, rpc=None, cache_path=TX_CACHE_PATH):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.rpc = rpc if rpc is not None else BatchRpc()
+        self.cache_path = cache_path
+        self._cache = None
+
+    @property
+    def cache(self):
+        # opened on first use, so importing the scripts never creates the database
+        if self._cache is None and self.cache_path:
+            self._cache = TransactionCache.open(self.cache_path)
+        return self._cache
+
+    def fetch_batch(self, keys):
+        if self.rpc.endpoint is None:
+            # no http endpoint to batch against (ipc / websocket), fall back to single calls
+            results = [web3.eth.getTransaction(key) for key in keys]
+        else:
+            results = self.rpc.call('eth_getTransactionByHash', [[key] for key in keys])
+        return {key: formatTransaction(raw) if raw else None for key, raw in zip(keys, results)}
+
+    def get_many(self, txids):
+        '''
+            returns {txKey: tx}. hashes in the transaction cache never reach the node;
+            hashes the node does not know are asked for once more, then raise
+            TransactionNotFound rather than coming back as None
+        '''
+        keys = list(dict.fromkeys(txKey(txid) for txid in txids))
+        transactions = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(bytes(HexBytes(key)) for key in keys)
+            for tx_hash, fields in cached.items():
+                transactions['0x' + tx_hash.hex()] = unpackTransaction(tx_hash, *fields)
+            keys = [key for key in keys if key not in transactions]
+        fetched = {}
+        batches = [keys[i:i + self.batch_size] for i in range(0, len(keys), self.batch_size)]
+        if len(batches) <= 1:
+            for batch in batches:
+                fetched.update(self.fetch_batch(batch))
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for result in pool.map(self.fetch_batch, batches):
+                    fetched.update(result)
+        missing = [key for key, tx in fetched.items() if tx is None]
+        if missing:
+            # load balanced nodes can briefly miss a transaction another backend has
+            fetched.update(self.fetch_batch(missing))
+            missing = [key for key in missing if fetched[key] is None]
+        if self.cache is not None:
+            self.cache.add_many(packTransaction(tx) for tx in fetched.values() if tx is not None)
+        if missing:
+            raise TransactionNotFound(f"{len(missing)} transactions unknown to the node, first {missing[0]}")
+        transactions.update(fetched)
+        return transactions
+
+    def report(self):
+        if self._cache is not None:
+            stats = self._cache.stats()
+            print(f"tx cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    def get(self, txid):
+        return self.get_many([txid])[txKey(txid)]
+
+    def resolve(self, items):
+        '''
+            takes (txid, payload) pairs and yields (payload, tx) in the same order,
+            buffering enough pairs to keep every worker busy with a full batch.
+            pairs with a txid of None are passed through with tx None
+        '''
+        items = iter(items)
+        buffer_size = self.batch_size * self.max_workers
+        while True:
+            buffer = list(islice(items, buffer_size))
+            if not buffer:
+                return
+            transactions = self.get_many(txid for txid, _ in buffer if txid is not None)
+            for txid, payload in buffer:
+                yield payload, (transactions[txKey(txid)] if txid is not None else None)
+
+
+TRANSACTIONS = TransactionFetcher()
+
+
+def getTransaction(txid):
+    '''
+        drop-in for web3.eth.getTransaction that goes through the shared transaction cache
+    '''
+    return TRANSACTIONS.get(txid)
@@ -1,45 +1,91 @@
 from brownie import web3
 from datetime import datetime
-from collections import Counter
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm, trange
 from toolz import valfilter
-from eth_abi import decode_single
+from eth_abi.decoding import ContextFramesBytesIO
+from eth_abi.registry import registry as abi_registry
 import requests
 import pytz
 import json
 from web3.exceptions import BadFunctionCallOutput
+from web3._utils.events import get_event_data
+from web3._utils.filters import construct_event_filter_params
+from eth_utils import event_abi_to_log_topic
+from eth_hash.auto import keccak as keccak256
+from .cache import LogCache, LOG_CACHE_PATH
+from .transactions import getTransaction
+from .bytecode import CODE
+from .reporting import REPORTER
+from .table import BalanceTable, writeTable
 
 
 class MerkleTree:
+    '''
+        sorted-pair keccak merkle tree. every layer is one contiguous bytes buffer of
+        32 byte nodes and leaves are indexed by hash, so proofs need no search
+    '''
     def __init__(self, elements):
-        self.elements = sorted(set(web3.keccak(hexstr=el) for el in elements))
-        self.layers = MerkleTree.get_layers(self.elements)
+        self.elements = sorted(set(keccak256(hexToBytes(el)) for el in elements))
+        self.leaf_index = {leaf: i for i, leaf in enumerate(self.elements)}
+        self.layers = MerkleTree.get_layers(b''.join(self.elements))
 
     @property
     def root(self):
-        return self.layers[-1][0]
+        return self.layers[-1][:32]
 
     def get_proof(self, el):
-        el = web3.keccak(hexstr=el)
-        idx = self.elements.index(el)
+        return self.get_proof_at(self.leaf_index[keccak256(hexToBytes(el))])
+
+    def get_proof_at(self, idx):
         proof = []
         for layer in self.layers:
             pair_idx = idx + 1 if idx % 2 == 0 else idx - 1
-            if pair_idx < len(layer):
-                proof.append(encode_hex(layer[pair_idx]))
+            if pair_idx * 32 < len(layer):
+                proof.append('0x' + layer[pair_idx * 32:pair_idx * 32 + 32].hex())
             idx //= 2
         return proof
 
+    def get_proofs(self, elements):
+        '''
+            proofs for every element in the given order, built layer by layer in one pass
+        '''
+        return self.get_proofs_at([self.leaf_index[keccak256(hexToBytes(el))] for el in elements])
+
+    def get_proofs_at(self, indices):
+        '''
+            proofs for the leaves at indices in the given order, built layer by layer in one pass
+        '''
+        indices = list(indices)
+        proofs = [[] for _ in indices]
+        for layer in self.layers[:-1]:
+            count = len(layer) // 32
+            for i, idx in enumerate(indices):
+                pair_idx = idx ^ 1
+                if pair_idx < count:
+                    proofs[i].append('0x' + layer[pair_idx * 32:pair_idx * 32 + 32].hex())
+                indices[i] = idx >> 1
+        return proofs
+
     @staticmethod
-    def get_layers(elements):
-        layers = [elements]
-        while len(layers[-1]) > 1:
+    def get_layers(leaves):
+        layers = [leaves]
+        while len(layers[-1]) > 32:
             layers.append(MerkleTree.get_next_layer(layers[-1]))
         return layers
 
     @staticmethod
-    def get_next_layer(elements):
-        return [MerkleTree.combined_hash(a, b) for a, b in zip_longest(elements[::2], elements[1::2])]
+    def get_next_layer(layer):
+        next_layer = bytearray()
+        paired = len(layer) - len(layer) % 64
+        for offset in range(0, paired, 64):
+            a = layer[offset:offset + 32]
+            b = layer[offset + 32:offset + 64]
+            next_layer += keccak256(a + b if a <= b else b + a)
+        # an unpaired last node moves up unchanged
+        next_layer += layer[paired:]
+        return bytes(next_layer)
 
     @staticmethod
     def combined_hash(a, b):
@@ -47,7 +93,7 @@ class MerkleTree:
             return b
         if b is None:
             return a
-        return web3.keccak(b''.join(sorted([a, b])))
+        return keccak256(a + b if a <= b else b + a)
 
 
 def getProposalsListUrl(item):
@@ -64,6 +110,9 @@ def getPage(url):
 def timestamp_to_datetime(timestamp):
     return datetime.fromtimestamp(int(timestamp), pytz.UTC)
 
+def hexToBytes(value):
+    return bytes.fromhex(value[2:] if value[:2] in ('0x', '0X') else value)
+
 def getFunctionSignature(tx_input):
     '''
         takes tx input data and returns the hex signature
@@ -97,12 +146,31 @@ def WriteJson(fn, data):
         json.dump(data, fp)
 
 
+def LoadTable(fn):
+    return BalanceTable(fn)
+
+
+def WriteTable(fn, data):
+    writeTable(fn, data)
+
+
 def processCounter(counter):
     filteredFinal = valfilter(bool, dict(counter.most_common()))
     return filteredFinal   
 
-def isContract(address):
-    return web3.eth.getCode(address).hex() != '0x'
+def isContract(address, block):
+    '''
+        whether address has code at block, normally the scrape's snapshot block. goes through
+        the code hash cache, so prefetchCode the addresses of a scrape first to batch the calls
+    '''
+    return CODE.is_contract(address, block)
+
+
+def prefetchCode(addresses, block):
+    '''
+        resolves the code hashes of every distinct address at block in one batched sweep
+    '''
+    CODE.get_many(addresses, block)
 
 
 
@@ -110,17 +178,18 @@ def isContract(address):
 
 
 class SnapShotScraper:
-    def __init__(self, key, cutoff, participants=None, debug=False):
+    def __init__(self, key, cutoff, participants=None, debug=False, base_url='https://hub.snapshot.page'):
         self.key = key
+        self.base_url = base_url.rstrip('/')
         self.cutoff = cutoff
         self.participants = participants if participants else Counter()
         self.debug = debug
     
     def getProposalsListUrl(self):
-        return f'https://hub.snapshot.page/api/{self.key}/proposals'    
+        return f'{self.base_url}/api/{self.key}/proposals'    
 
     def getProposalUrl(self, snapshot_id):
-        return f'https://hub.snapshot.page/api/{self.key}/proposal/{snapshot_id}'
+        return f'{self.base_url}/api/{self.key}/proposal/{snapshot_id}'
 
     def scrape(self):
         proposals = getPage(self.getProposalsListUrl())
@@ -141,25 +210,190 @@ class SnapShotScraper:
         return self.participants
 
 
+# blocks behind the head before a fetched window is trusted enough to cache
+REORG_DEPTH = 100
+# blocks per read when replaying a cached range
+CACHE_READ_CHUNK = 100000
+
+TOO_MANY_RESULTS_ERRORS = (
+    'query returned more than',
+    'response size exceeded',
+    'response size should not',
+    'limit exceeded',
+    'too many results',
+    'block range is too wide',
+    'query timeout exceeded',
+)
+
+
+def isTooManyResultsError(error):
+    '''
+        true when the node refused a getLogs call because the window held too many logs
+    '''
+    message = error.args[0] if error.args else error
+    if isinstance(message, dict):
+        message = message.get('message', '')
+    message = str(message).lower()
+    return any(pattern in message for pattern in TOO_MANY_RESULTS_ERRORS)
+
+
 class ContractLogParser:
-    def __init__(self, startBlock, endBlock, address, abi_fn, event_name, use_amount_as_airdrop=False, chunk_amount=1000):
+    def __init__(self, startBlock, endBlock, address, abi_fn, event_name, use_amount_as_airdrop=False, chunk_amount=1000,
+                 max_workers=8, min_chunk=10, max_chunk=100000, target_logs=2000, cache_path=LOG_CACHE_PATH):
         self.startBlock = startBlock
         self.endBlock = endBlock
         self.address = address
         self.chunk_amount = chunk_amount
         self.contract = web3.eth.contract(address, abi=LoadJson(abi_fn))
-        self.event = getattr(self.contract.events, event_name)
+        # several event names scan them all with one topic0 OR-filter per window
+        self.event_names = [event_name] if isinstance(event_name, str) else list(event_name)
+        self.events = [getattr(self.contract.events, name) for name in self.event_names]
+        self.event = self.events[0]
+        self.event_abi = self.event._get_event_abi()
+        self.event_abis = {
+            event_abi_to_log_topic(event._get_event_abi()): event._get_event_abi() for event in self.events
+        }
         self.use_amount_as_airdrop = use_amount_as_airdrop
-
-
-    def get_logs(self, argument_filters=None):
-        for start in trange(self.startBlock, self.endBlock, self.chunk_amount):
-            end = min(start + 999, self.endBlock)
-            # logs = self.event().getLogs(fromBlock=start, toBlock=end)
-            logs = self.event().getLogs(fromBlock=start, toBlock=end, argument_filters=argument_filters)
+        self.max_workers = max_workers
+        self.min_chunk = min_chunk
+        self.max_chunk = max(max_chunk, chunk_amount)
+        self.target_logs = target_logs
+        self.log_cache = LogCache.open(cache_path) if cache_path else None
+
+    def filter_params(self, argument_filters=None):
+        if len(self.events) > 1:
+            if argument_filters:
+                raise ValueError("argument_filters only work when scanning a single event")
+            topics = ['0x' + topic.hex() for topic in self.event_abis]
+            return {'address': self.address, 'topics': [topics]}
+        _, params = construct_event_filter_params(
+            self.event_abi, web3.codec, contract_address=self.address, argument_filters=argument_filters)
+        return params
+
+    def decode(self, log):
+        event_abi = self.event_abis[bytes(log['topics'][0])] if len(self.events) > 1 else self.event_abi
+        return get_event_data(web3.codec, event_abi, log)
+
+    def fetch_window(self, start, end, params):
+        '''
+            fetches raw logs for [start, end], splitting the window in half whenever
+            the node rejects it for returning too many results
+        '''
+        try:
+            return list(web3.eth.getLogs(dict(params, fromBlock=start, toBlock=end))), False
+        except ValueError as e:
+            if not isTooManyResultsError(e) or start == end:
+                raise
+        middle = (start + end) // 2
+        left, _ = self.fetch_window(start, middle, params)
+        right, _ = self.fetch_window(middle + 1, end, params)
+        return left + right, True
+
+    def next_chunk(self, chunk, log_count, was_split):
+        '''
+            grows the window over sparse ranges and shrinks it over dense ones
+        '''
+        if was_split or log_count > self.target_logs:
+            return max(chunk // 2, self.min_chunk)
+        if log_count < self.target_logs // 4:
+            return min(chunk * 2, self.max_chunk)
+        return chunk
+
+    def fetch_windows(self, start, stop, params):
+        '''
+            yields (start, end, raw_logs) for consecutive windows of [start, stop] in
+            block order while up to max_workers windows are fetched concurrently
+        '''
+        chunk = self.chunk_amount
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, \
+                tqdm(total=max(stop - start + 1, 0), unit='block') as progress:
+            while start <= stop or pending:
+                while start <= stop and len(pending) < self.max_workers:
+                    end = min(start + chunk - 1, stop)
+                    future = pool.submit(self.fetch_window, start, end, params)
+                    pending.append((start, end, future))
+                    start = end + 1
+                window_start, window_end, future = pending.popleft()
+                logs, was_split = future.result()
+                chunk = self.next_chunk(chunk, len(logs), was_split)
+                progress.update(window_end - window_start + 1)
+                yield window_start, window_end, logs
+
+    def iter_windows(self, argument_filters=None, startBlock=None):
+        '''
+            yields (start, end, logs) in block order, reading ranges already in the
+            log cache from disk and fetching (then caching) only the rest
+        '''
+        start = self.startBlock if startBlock is None else startBlock
+        params = self.filter_params(argument_filters)
+        if self.log_cache is None:
+            for window_start, window_end, logs in self.fetch_windows(start, self.endBlock, params):
+                yield window_start, window_end, [self.decode(log) for log in logs]
+            return
+        topics = params.get('topics')
+        # ranges close to the head can still be reorged, never mark them as covered
+        safe_block = web3.eth.blockNumber - REORG_DEPTH
+        for segment_start, segment_end, is_cached in self.log_cache.plan(self.address, topics, start, self.endBlock):
+            if is_cached:
+                for window_start in range(segment_start, segment_end + 1, CACHE_READ_CHUNK):
+                    window_end = min(window_start + CACHE_READ_CHUNK - 1, segment_end)
+                    logs = self.log_cache.get_logs(self.address, topics, window_start, window_end)
+                    yield window_start, window_end, [self.decode(log) for log in logs]
+                continue
+            for window_start, window_end, logs in self.fetch_windows(segment_start, segment_end, params):
+                if window_end <= safe_block:
+                    self.log_cache.add_logs(self.address, topics, window_start, window_end, logs)
+                yield window_start, window_end, [self.decode(log) for log in logs]
+
+    def get_logs(self, argument_filters=None, startBlock=None):
+        for _, _, logs in self.iter_windows(argument_filters, startBlock):
             for log in logs:
                 yield log
 
+    def dispatch(self, handlers):
+        '''
+            scans every event the parser was built with at once and calls
+            handlers[log.event](log) in block order. handlers needs exactly those events
+        '''
+        if set(handlers) != set(self.event_names):
+            raise ValueError(
+                f"handlers for {sorted(handlers)} do not match the scanned events {sorted(self.event_names)}")
+        for log in self.get_logs():
+            handlers[log.event](log)
+
+
+
+def joinLogsByTransaction(logs, other_logs):
+    '''
+        streaming hash join of two block ordered log streams on transaction hash.
+        yields (log, matches) where matches is the list of other_logs from the same
+        transaction; callers may remove the entries they consume from it.
+        only the other_logs of the current block are held in memory
+    '''
+    other_logs = iter(other_logs)
+    lookahead = next(other_logs, None)
+    index = defaultdict(list)
+    indexed_block = None
+    for log in logs:
+        block = log.blockNumber
+        if indexed_block != block:
+            index.clear()
+            indexed_block = block
+        while lookahead is not None and lookahead.blockNumber <= block:
+            if lookahead.blockNumber == block:
+                index[bytes(lookahead.transactionHash)].append(lookahead)
+            lookahead = next(other_logs, None)
+        yield log, index[bytes(log.transactionHash)]
+
+
+def toCalldata(tx_input):
+    '''
+        takes tx input as hex string or bytes and returns raw bytes
+    '''
+    if isinstance(tx_input, str):
+        return hexToBytes(tx_input)
+    return bytes(tx_input)
 
 
 class TxDataParser:
@@ -171,15 +405,19 @@ class TxDataParser:
         self.signature = strToFunctionSignature(definition)
         self.is_meta_transaction = is_meta_transaction
         self.use_sender_address = use_sender_address
+        # resolve the decoder and field positions once instead of on every call
+        self.decoder = abi_registry.get_decoder(self.args)
+        self.want_indices = tuple(names.index(want) for want in want_fields)
+
+    def decode(self, args_data):
+        '''
+            takes the calldata bytes after the selector and returns the want_fields
+        '''
+        result = self.decoder(ContextFramesBytesIO(args_data))
+        return [result[i] for i in self.want_indices]
 
     def parse_tx(self, tx_data):
-        if type(tx_data) == str:
-            tx_data = bytes.fromhex(tx_data[10:])
-        elif type(tx_data) == bytes:
-            tx_data = tx_data[4:]            
-        result = decode_single(self.args, tx_data)
-        result = dict(zip(self.names, result))
-        return [result.get(want) for want in self.want_fields]
+        return self.decode(toCalldata(tx_data)[4:])
 
 
 ARGENT = TxDataParser(
@@ -273,30 +511,50 @@ PARSERS = {
 }
 
 
+class DecoderRegistry:
+    '''
+        parsers keyed by their raw 4 byte selector
+    '''
+    def __init__(self, parsers):
+        self.parsers = {bytes.fromhex(signature[2:]): parser for signature, parser in parsers.items()}
+
+    def decode_calldata(self, data, sender, second_pass=False):
+        parser = self.parsers.get(data[:4])
+        if parser is None:
+            return None
+        want_fields = parser.decode(data[4:])
+        if parser.is_meta_transaction and second_pass == False:
+            # meta transactions wrap the real call, decode the inner calldata
+            user_address, tx_data = want_fields
+            return self.decode_calldata(tx_data, sender, second_pass=True)
+        if parser.use_sender_address:
+            want_fields[0] = sender
+        user_address, amount = want_fields
+        return (user_address, amount)
+
+    def decode(self, tx):
+        '''
+            returns (user_address, amount) for a tx, None when its selector is unknown
+        '''
+        return self.decode_calldata(toCalldata(tx['input']), tx.get('from'))
+
+    def decode_many(self, txs):
+        return [self.decode(tx) for tx in txs]
+
+
+DECODERS = DecoderRegistry(PARSERS)
+
+
 def getMintersInfo(tx, second_pass=False):
-    signature = getFunctionSignature(tx['input'])
-    parser = PARSERS.get(signature, None)
-    if parser is None:
-        #print(f"No Match for tx signature {tx['hash'].hex()}")
-        return None 
-    want_fields = parser.parse_tx(tx['input'])
-    if parser.is_meta_transaction and second_pass == False:
-        user_address, tx_data = want_fields
-        tx_copy = tx.__dict__.copy()
-        tx_copy['input'] = tx_data
-        return getMintersInfo(tx_copy, second_pass=True)
-    if parser.use_sender_address:
-        want_fields[0] = tx.get("from")
-    user_address, amount = want_fields
-    return (user_address, amount)
-
-def processBalancePoolJoin(log):
+    return DECODERS.decode_calldata(toCalldata(tx['input']), tx.get('from'), second_pass)
+
+def processBalancePoolJoin(log, block):
     try:
         address = getDSProxyOwner(log.args.caller)
         #print(f"{address} added {log.args.tokenAmountIn/1e8}")
         return (address, log.args.tokenAmountIn)
     except ValueError:
-        tx = web3.eth.getTransaction(log.transactionHash.hex())
+        tx = getTransaction(log.transactionHash)
         sig = getFunctionSignature(tx.input)
         if sig == '0xaacaaf88':
             wallet, _ = ARGENT.parse_tx(tx.input)
@@ -304,16 +562,26 @@ def processBalancePoolJoin(log):
             return (wallet, log.args.tokenAmountIn)
         return None  
     except BadFunctionCallOutput:
-        if isContract(log.args.caller) == False:
+        if isContract(log.args.caller, block) == False:
             #print(f"{log.args.caller} not a contract")
             return (log.args.caller, log.args.tokenAmountIn)
         else:
-            print(f"{log.args.caller} has error from tx {log.transactionHash.hex()} BadFunctionCallOutput") 
+            REPORTER.event('balancer_join.error', caller=log.args.caller, tx=log.transactionHash.hex(), error='BadFunctionCallOutput')
             return None
     except Exception as e:
         #here is 
-        print(f"{log.args.caller} has error from tx {log.transactionHash.hex()} of {e}")    
+        REPORTER.event('balancer_join.error', caller=log.args.caller, tx=log.transactionHash.hex(), error=e)
         #errors3.append([x.args.caller,x.transactionHash.hex()])    
         return None
 
+
+def processBalancePoolJoins(logs, block):
+    '''
+        processBalancePoolJoin over a whole scrape, callers checked at the snapshot block
+        with their code fetched up front in one batched sweep
+    '''
+    logs = list(logs)
+    prefetchCode({log.args.caller for log in logs}, block)
+    return [processBalancePoolJoin(log, block) for log in logs]
+
 #def 
\ No newline at end of file